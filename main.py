@@ -1,6 +1,9 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
+import numpy as np
 import gspread
+from gspread.utils import absolute_range_name, numericise_all, rightpad, rowcol_to_a1, to_records
 from google.oauth2.service_account import Credentials
 import google.generativeai as genai
 import os
@@ -9,6 +12,16 @@ import plotly.express as px
 from io import BytesIO
 from datetime import datetime
 import functools
+import hashlib
+import hmac
+import html
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
 
 # ============================
 # הגדרת הדף
@@ -23,6 +36,60 @@ st.set_page_config(
 # ============================
 # CSS + JS גלובלי
 # ============================
+CARD_CSS = """
+    .smart-card {
+        border-radius: 14px;
+        padding: 14px 18px;
+        margin-bottom: 10px;
+        display: flex;
+        align-items: center;
+        gap: 14px;
+        box-shadow: 0 2px 12px rgba(0,0,0,0.06);
+        direction: rtl;
+        transition: transform 0.15s, box-shadow 0.15s;
+        border: 1px solid transparent;
+    }
+    .smart-card:hover { transform: translateY(-2px); box-shadow: 0 6px 20px rgba(0,0,0,0.1); }
+    .smart-card.debit  { background: #fff5f5; border-right: 4px solid #e53935; border-color: #fee2e2; }
+    .smart-card.credit { background: #f0fdf4; border-right: 4px solid #43a047; border-color: #dcfce7; }
+    .smart-card.failed { background: #fffbeb; border-right: 4px solid #f9a825; border-color: #fef3c7; }
+    .smart-card.admin  { background: #eff6ff; border-right: 4px solid #1e88e5; border-color: #dbeafe; }
+    .card-circle {
+        min-width: 60px; height: 60px;
+        border-radius: 14px;
+        display: flex; align-items: center; justify-content: center;
+        font-weight: 800; font-size: 0.72rem;
+        flex-shrink: 0; text-align: center; line-height: 1.3;
+        direction: ltr;
+    }
+    .debit  .card-circle { background: #fee2e2; color: #b71c1c; }
+    .credit .card-circle { background: #dcfce7; color: #14532d; }
+    .failed .card-circle { background: #fef3c7; color: #92400e; }
+    .admin  .card-circle { background: #dbeafe; color: #1e3a8a; }
+    .card-main { flex: 1; min-width: 0; direction: rtl; }
+    .card-main .c-title {
+        font-weight: 600; font-size: 0.9rem; color: #1e293b; margin-bottom: 4px;
+        white-space: nowrap; overflow: hidden; text-overflow: ellipsis;
+        direction: rtl; text-align: right;
+    }
+    .card-main .c-sub   { font-size: 0.78rem; color: #64748b; direction: rtl; text-align: right; }
+    .card-direction {
+        font-size: 0.7rem; font-weight: 700; padding: 2px 8px;
+        border-radius: 8px; margin-top: 4px; display: inline-block;
+    }
+    .dir-credit { background: #dcfce7; color: #14532d; }
+    .dir-debit  { background: #fee2e2; color: #b71c1c; }
+    .dir-admin  { background: #dbeafe; color: #1e3a8a; }
+    .card-side { text-align: right; min-width: 100px; flex-shrink: 0; direction: rtl; }
+    .badge { display: inline-block; padding: 3px 10px; border-radius: 20px; font-size: 0.68rem; font-weight: 700; margin-bottom: 4px; }
+    .badge-ok     { background: #dcfce7; color: #14532d; }
+    .badge-failed { background: #fef3c7; color: #92400e; }
+    .badge-admin  { background: #dbeafe; color: #1e3a8a; }
+    .c-date  { font-size: 0.7rem; color: #94a3b8; margin: 3px 0; direction: ltr; text-align: right; }
+    .c-phone { font-size: 0.68rem; color: #cbd5e1; direction: ltr; text-align: right; }
+"""
+
+
 def inject_css():
     st.markdown("""
     <style>
@@ -259,57 +326,7 @@ def inject_css():
     .mc-icon   { position: absolute; top: 18px; left: 20px; font-size: 2rem; opacity: 0.2; }
 
     /* ── Smart cards ── */
-    .smart-card {
-        border-radius: 14px;
-        padding: 14px 18px;
-        margin-bottom: 10px;
-        display: flex;
-        align-items: center;
-        gap: 14px;
-        box-shadow: 0 2px 12px rgba(0,0,0,0.06);
-        direction: rtl;
-        transition: transform 0.15s, box-shadow 0.15s;
-        border: 1px solid transparent;
-    }
-    .smart-card:hover { transform: translateY(-2px); box-shadow: 0 6px 20px rgba(0,0,0,0.1); }
-    .smart-card.debit  { background: #fff5f5; border-right: 4px solid #e53935; border-color: #fee2e2; }
-    .smart-card.credit { background: #f0fdf4; border-right: 4px solid #43a047; border-color: #dcfce7; }
-    .smart-card.failed { background: #fffbeb; border-right: 4px solid #f9a825; border-color: #fef3c7; }
-    .smart-card.admin  { background: #eff6ff; border-right: 4px solid #1e88e5; border-color: #dbeafe; }
-    .card-circle {
-        min-width: 60px; height: 60px;
-        border-radius: 14px;
-        display: flex; align-items: center; justify-content: center;
-        font-weight: 800; font-size: 0.72rem;
-        flex-shrink: 0; text-align: center; line-height: 1.3;
-        direction: ltr;
-    }
-    .debit  .card-circle { background: #fee2e2; color: #b71c1c; }
-    .credit .card-circle { background: #dcfce7; color: #14532d; }
-    .failed .card-circle { background: #fef3c7; color: #92400e; }
-    .admin  .card-circle { background: #dbeafe; color: #1e3a8a; }
-    .card-main { flex: 1; min-width: 0; direction: rtl; }
-    .card-main .c-title {
-        font-weight: 600; font-size: 0.9rem; color: #1e293b; margin-bottom: 4px;
-        white-space: nowrap; overflow: hidden; text-overflow: ellipsis;
-        direction: rtl; text-align: right;
-    }
-    .card-main .c-sub   { font-size: 0.78rem; color: #64748b; direction: rtl; text-align: right; }
-    .card-direction {
-        font-size: 0.7rem; font-weight: 700; padding: 2px 8px;
-        border-radius: 8px; margin-top: 4px; display: inline-block;
-    }
-    .dir-credit { background: #dcfce7; color: #14532d; }
-    .dir-debit  { background: #fee2e2; color: #b71c1c; }
-    .dir-admin  { background: #dbeafe; color: #1e3a8a; }
-    .card-side { text-align: right; min-width: 100px; flex-shrink: 0; direction: rtl; }
-    .badge { display: inline-block; padding: 3px 10px; border-radius: 20px; font-size: 0.68rem; font-weight: 700; margin-bottom: 4px; }
-    .badge-ok     { background: #dcfce7; color: #14532d; }
-    .badge-failed { background: #fef3c7; color: #92400e; }
-    .badge-admin  { background: #dbeafe; color: #1e3a8a; }
-    .c-date  { font-size: 0.7rem; color: #94a3b8; margin: 3px 0; direction: ltr; text-align: right; }
-    .c-phone { font-size: 0.68rem; color: #cbd5e1; direction: ltr; text-align: right; }
-
+""" + CARD_CSS + """
     /* ── Section titles ── */
     .section-title {
         font-size: 1rem;
@@ -706,150 +723,1172 @@ def _get_gemini_model_name():
         return "gemini-pro"
 
 
-@st.cache_data(ttl=600)
-def get_all_data():
-    """FIX #13 – cache 10 דקות."""
-    client = get_client()
-    sh = client.open_by_key(SPREADSHEET_ID)
-    df_users   = pd.DataFrame(sh.worksheet("משתמשים").get_all_records())
-    df_actions = pd.DataFrame(sh.worksheet("פעולות").get_all_records())
+# ============================
+# סכמה – נרמול חד-פעמי בזמן הטעינה
+# ============================
+# עמודות תצוגה של כרטיסי הפעולות (card_fields) – מחושבות פעם אחת לכל גרסה
+CARD_FIELDS  = ["card_kind", "card_desc", "card_uid", "card_amount", "card_after", "card_date", "card_time", "card_phone"]
+# עמודות מחושבות שנוספות בטעינה; לא נכתבות ל-snapshot ולא מיוצאות למשתמש
+DERIVED_COLS = ["סכום_num", "תאריך_dt", "סטטוס_סוג", "יתרה_num", *CARD_FIELDS]
+# עמודות רגישות – לא נשלחות לדפדפן, לא נכנסות לאינדקס החיפוש ולא נכתבות לדיסק (גם לא כתקציר)
+SENSITIVE_COLS = ["סיסמה"]
+# פרטים אישיים שלא נכתבים ל-snapshot; מגיעים עם רענון המשתמשים שאחרי טעינה מהדיסק
+PRIVATE_COLS   = ["תעודת זהות", "כתובת"]
+# ערכים שנחשבים ריקים בטקסט ובמספרי משתמש ("0" = אין משתמש, למשל מקור של הפקדה)
+EMPTY_VALUES   = ("", "nan", "None", "0")
+# טקסט שחוזר על עצמו בפעולות – נשמר כ-category: קוד שלם לכל שורה + טבלת ערכים אחת
+CATEGORY_COLS = ["תאריך", "שעה", "מספר משתמש מקור", "שם מקור", "מספר משתמש יעד", "שם יעד", "סכום", "סטטוס", "סטטוס_סוג"]
+
+
+def _to_float(col: pd.Series) -> pd.Series:
+    """כמו float(v) עם נפילה ל-0 – בצורה וקטורית; רק ערכים חריגים עוברים דרך float()."""
+    num = pd.to_numeric(col, errors="coerce")
+    if col.dtype.kind == "f": return num
+    odd = num.isna() & col.notna() & (col.astype(str) != "")
+    if odd.any():
+        def _f(v):
+            try:    return float(v)
+            except: return 0.0
+        num[odd] = col[odd].map(_f)
+    return num.where(num.notna() | odd, 0.0)
+
+
+def _str_col(col: pd.Series) -> pd.Series:
+    return col.astype(str).fillna("").str.strip()
+
+
+def _parse_datetime(date: pd.Series, hour: pd.Series) -> pd.Series:
+    """תאריך + שעה → datetime. ISO (YYYY-MM-DD) קודם, אחר כך פורמטים ישראליים (יום ראשון)."""
+    d   = _str_col(date)
+    ymd = d.str.extract(r"^(\d{4}-\d{1,2}-\d{1,2})", expand=False)
+    dt  = pd.to_datetime(ymd, format="%Y-%m-%d", errors="coerce")
+    rest = dt.isna() & ymd.isna() & (d != "")
+    if rest.any():
+        dt[rest] = pd.to_datetime(d[rest], dayfirst=True, format="mixed", errors="coerce")
+    t = _str_col(hour)
+    t = t.where(~t.str.fullmatch(r"\d{1,2}:\d{2}"), t + ":00")
+    return dt + pd.to_timedelta(t, errors="coerce").fillna(pd.Timedelta(0))
+
+
+def _status_kind(status: pd.Series) -> pd.Series:
+    s = status.astype(str).fillna("")
+    return pd.Series(np.select([s.str.contains("מנהל"), s.str.contains("כושל|נכשל")],
+                               ["פעולת מנהל", "כושלת"], default="מוצלחת"), index=status.index)
+
+
+def _normalize_users(df: pd.DataFrame) -> pd.DataFrame:
+    """מזהים וסיסמאות כמחרוזות נקיות, יתרה מספרית ב-יתרה_num."""
+    if df.columns.empty: return df
+    df = df.copy()
+    for col in ("מספר משתמש", "סיסמה"):
+        if col in df.columns: df[col] = _str_col(df[col])
+    if "יתרה" in df.columns: df["יתרה_num"] = _to_float(df["יתרה"])
+    return df
+
+
+def _normalize_actions(df: pd.DataFrame) -> pd.DataFrame:
+    """מזהים כמחרוזות נקיות, סכום_num מספרי, תאריך_dt מתאריך+שעה, סטטוס_סוג מקוטלג."""
+    if df.columns.empty: return df
+    df = df.copy()
+    for col in ("מספר משתמש מקור", "מספר משתמש יעד"):
+        if col in df.columns: df[col] = _str_col(df[col])
+    empty = pd.Series("", index=df.index)
+    df["סכום_num"]   = _to_float(df["סכום"]) if "סכום" in df.columns else 0.0
+    df["תאריך_dt"]   = _parse_datetime(df.get("תאריך", empty), df.get("שעה", empty))
+    df["סטטוס_סוג"] = _status_kind(df.get("סטטוס", empty))
+    for col in CATEGORY_COLS:
+        if col in df.columns: df[col] = _categorize(df[col])
+    return df
+
+
+def _categorize(col: pd.Series) -> pd.Series:
+    return col if pd.api.types.is_numeric_dtype(col) else col.astype("category")
+
+
+def _append_actions(df: pd.DataFrame, chunk: pd.DataFrame) -> pd.DataFrame:
+    """df ואחריו chunk; concat של category עם ערכים שונים מחזיר object – מאחדים את הקטגוריות מחדש."""
+    if df.columns.empty: return chunk  # הגיליון היה ריק (כותרת בלבד) – אין מה לאחד
+    out = pd.concat([df, chunk], ignore_index=True)
+    for col in CATEGORY_COLS:
+        if col not in out.columns or isinstance(out[col].dtype, pd.CategoricalDtype): continue
+        parts = [df[col], chunk[col]]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            try:    out[col] = pd.api.types.union_categoricals(parts, sort_categories=True)
+            except TypeError: out[col] = _categorize(out[col])  # ערכים מטיפוסים שונים – קידוד מחדש
+        else:       out[col] = _categorize(out[col])  # אחד הצדדים מספרי
+    return out
+
+
+# ============================
+# טעינה מ-Sheets – בקשת batch אחת + סנכרון מצטבר של הפעולות
+# ============================
+ACTIONS_SHEET            = "פעולות"
+ACTIONS_FULL_RESYNC_SECS = 60 * 60  # סריקה מלאה תקופתית – תופסת עריכות באמצע הגיליון
+
+
+@st.cache_resource
+def _get_actions_sync():
+    """מצב הסנכרון המצטבר של "פעולות" – נשמר בין טעינות."""
+    return {"lock": threading.Lock(), "header": None, "rows": 0, "anchor": None,
+            "df": None, "kpi": None, "full_at": 0.0}
+
+
+def _trim_row(row) -> list:
+    """מסיר תאים ריקים מסוף שורה – קריאת טווח לא מחזירה אותם."""
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+def _records_df(header: list, rows: list) -> pd.DataFrame:
+    """שורות גולמיות → DataFrame, בדיוק כמו get_all_records (ריפוד + המרת מספרים)."""
+    return pd.DataFrame(to_records(header, [numericise_all(rightpad(list(r), len(header))) for r in rows]))
+
+
+def _values_df(values: list) -> pd.DataFrame:
+    """טווח גיליון שלם (כותרת + שורות) → DataFrame."""
+    header = _trim_row(values[0]) if values else []
+    return _records_df(header, values[1:] if header else [])
+
+
+def _batch_values(ranges: list) -> list:
+    """כל הטווחים בבקשת HTTP אחת (values:batchGet) – רשימת ערכים לכל טווח, לפי הסדר."""
+    resp = get_client().http_client.values_batch_get(SPREADSHEET_ID, ranges)
+    return [vr.get("values", []) for vr in resp["valueRanges"]]
+
+
+def _actions_ranges(state) -> list:
+    """מה לקרוא מ"פעולות" בסבב הזה: כל הגיליון, או שורת הכותרת + מהעוגן והלאה.
+
+    השורה האחרונה שסונכרנה נקראת שוב כ"עוגן". אם היא או הכותרת השתנו
+    (עריכה / מחיקה) – חוזרים לטעינה מלאה. עריכות באמצע הגיליון נתפסות
+    בטעינה המלאה התקופתית (ACTIONS_FULL_RESYNC_SECS).
+    """
+    if (state["df"] is None or not state["header"]
+            or time.time() - state["full_at"] > ACTIONS_FULL_RESYNC_SECS):
+        return [absolute_range_name(ACTIONS_SHEET)]
+    last_col = rowcol_to_a1(1, len(state["header"]))[:-1]
+    # שורה rows+1 בגיליון = העוגן (או הכותרת כשאין עדיין נתונים)
+    return [absolute_range_name(ACTIONS_SHEET, "1:1"),
+            absolute_range_name(ACTIONS_SHEET, f"A{state['rows'] + 1}:{last_col}")]
+
+
+def _kpi_chunk(df: pd.DataFrame) -> dict:
+    """מדדי מערכת לקבוצת פעולות, בצורה שניתן לצבור: מספרים, קבוצת משתמשים (בלי EMPTY_VALUES), מחזור ליום / לחודש,
+    ו-ledger – השינוי ביתרה של כל uid לפי הפעולות (מקור בחובה, יעד בזכות, בלי פעולות כושלות)."""
+    if not _has_actions(df):
+        return {"count": len(df), "volume": 0.0, "failed": 0, "users": frozenset(),
+                "daily": pd.Series(dtype=float), "monthly": pd.Series(dtype=float), "ledger": pd.Series(dtype=float)}
+    amount = df["סכום_num"].fillna(0.0)
+    day    = df["תאריך_dt"].dt.normalize()
+    src, dst = df["מספר משתמש מקור"].to_numpy(), df["מספר משתמש יעד"].to_numpy()
+    users  = set(pd.unique(src)) | set(pd.unique(dst))
+    failed = (df["סטטוס_סוג"] == "כושלת").to_numpy()
+    ok     = amount.to_numpy()[~failed]
+    ledger = pd.Series(np.concatenate([-ok, ok]), index=np.concatenate([src[~failed], dst[~failed]]))
+    ledger = ledger.groupby(level=0).sum()
+    return {"count": len(df), "volume": float(amount.sum()), "failed": int(failed.sum()),
+            "users": frozenset(users - set(EMPTY_VALUES)),
+            "daily": amount.groupby(day).sum(), "monthly": amount.groupby(day.dt.to_period("M")).sum(),
+            "ledger": ledger[~ledger.index.isin(EMPTY_VALUES)]}
+
+
+def _kpi_merge(kpi: dict, chunk: dict) -> dict:
+    """מצרף מדדים של פעולות חדשות – O(החלק החדש + מספר הימים), בלי לעבור שוב על כל הגיליון."""
+    return {"count": kpi["count"] + chunk["count"], "volume": kpi["volume"] + chunk["volume"],
+            "failed": kpi["failed"] + chunk["failed"], "users": kpi["users"] | chunk["users"],
+            "daily": kpi["daily"].add(chunk["daily"], fill_value=0.0),
+            "monthly": kpi["monthly"].add(chunk["monthly"], fill_value=0.0),
+            "ledger": kpi["ledger"].add(chunk["ledger"], fill_value=0.0)}
+
+
+def kpi_summary(kpi: dict, day: pd.Timestamp | None = None) -> dict:
+    """מדדי הלוח של המנהל מתוך המצבר – בלי מעבר על הפעולות."""
+    day   = (day or pd.Timestamp.now()).normalize()
+    count = max(kpi["count"], 1)
+    return {"מחזור": kpi["volume"], "פעולות": kpi["count"], "ממוצע": kpi["volume"] / count,
+            "פעילים": len(kpi["users"]), "כושלות_אחוז": 100.0 * kpi["failed"] / count,
+            "מחזור_היום": float(kpi["daily"].get(day, 0.0)),
+            "מחזור_החודש": float(kpi["monthly"].get(pd.Period(day, "M"), 0.0))}
+
+
+def _reload_actions(state, values: list) -> pd.DataFrame:
+    header = _trim_row(values[0]) if values else []
+    rows   = values[1:] if header else []
+    df     = _normalize_actions(_records_df(header, rows))
+    state.update(header=header, rows=len(rows), df=df, kpi=_kpi_chunk(df),
+                 anchor=_trim_row(rows[-1]) if rows else header, full_at=time.time())
+    return state["df"]
+
+
+def _apply_actions(state, values: list):
+    """מחיל את תוצאת _actions_ranges; None = העוגן לא תואם ונדרשת טעינה מלאה."""
+    if len(values) == 1:
+        return _reload_actions(state, values[0])
+    head, tail = values
+    if (_trim_row(head[0] if head else []) != state["header"]
+            or not tail or _trim_row(tail[0]) != state["anchor"]):
+        return None
+    new_rows = tail[1:]
+    if new_rows:
+        chunk = _normalize_actions(_records_df(state["header"], new_rows))
+        state["df"]  = _append_actions(state["df"], chunk)
+        state["kpi"] = _kpi_merge(state["kpi"], _kpi_chunk(chunk))
+        state["rows"]   = state["rows"] + len(new_rows)
+        state["anchor"] = _trim_row(new_rows[-1])
+    return state["df"]
+
+
+DATASETS = ("users", "actions", "admins", "content")
+_SHEETS  = {"users": "משתמשים", "admins": "מנהלים", "content": "תוכן"}
+_OPTIONAL_SHEETS = ("admins", "content")  # גיליונות שאולי לא קיימים
+
+
+def _fetch_data(datasets=DATASETS, base: dict | None = None) -> dict:
+    """משתמשים, מנהלים, תוכן והפעולות החדשות – בבקשת batch אחת ל-Sheets.
+
+    datasets – מה לטעון מחדש; כל השאר נלקח מ-base כמו שהוא (בלי base נטען הכול).
+    """
+    if base is None: datasets = DATASETS
+    sheets = [ds for ds in _SHEETS if ds in datasets]
+    sync = _get_actions_sync()
+    with sync["lock"]:
+        act_ranges = _actions_ranges(sync) if "actions" in datasets else []
+        try:
+            values = _batch_values([absolute_range_name(_SHEETS[ds]) for ds in sheets] + act_ranges)
+        except gspread.exceptions.APIError:
+            # גיליון אופציונלי חסר מפיל את כל ה-batch – טוענים בלעדיו
+            required = [ds for ds in sheets if ds not in _OPTIONAL_SHEETS]
+            if required == sheets: raise
+            got = _batch_values([absolute_range_name(_SHEETS[ds]) for ds in required] + act_ranges)
+            values = [got[required.index(ds)] if ds in required else [] for ds in sheets] + got[len(required):]
+        df_actions = base["actions"] if base is not None else None
+        kpi        = base["kpi"] if base is not None else None
+        if "actions" in datasets:
+            df_actions = _apply_actions(sync, values[len(sheets):])
+            if df_actions is None:
+                df_actions = _reload_actions(sync, _batch_values([absolute_range_name(ACTIONS_SHEET)])[0])
+            kpi = sync["kpi"]
+    data = dict(base) if base is not None else {}
+    fresh = dict(zip(sheets, values))
+    if "users" in fresh:
+        data["users"] = _normalize_users(_values_df(fresh["users"]))
+        data.pop("users_from_disk", None)
+    if "admins" in fresh:
+        df_admins = _values_df(fresh["admins"])
+        data["admins"] = _str_col(df_admins.iloc[:, 0]).tolist() if not df_admins.columns.empty else []
+    if "content" in fresh:
+        data["content"] = _values_df(fresh["content"])
+    data["actions"], data["kpi"] = df_actions, kpi
+    # זמן הסנכרון לכל מערך נתונים; synced_at = הישן מביניהם (ממנו נמדד ה-TTL)
+    synced = {**(base or {}).get("synced", {}), **dict.fromkeys(datasets, time.time())}
+    data.update(synced=synced, synced_at=min(synced.values()),
+                version=_data_version(data["users"], data["actions"], data["admins"], data["content"]))
+    return data
+
+
+# ============================
+# Snapshot מקומי + מאגר נתונים בזיכרון
+# ============================
+DATA_TTL_SECS   = 600  # FIX #13 – רענון כל 10 דקות (ברקע – המשתמשים לא ממתינים)
+# מעבר לגיל הזה לא מגישים נתונים ישנים – ממתינים לטעינה (למשל כשהרענון ברקע נכשל שוב ושוב)
+DATA_MAX_STALENESS_SECS = int(os.environ.get("DATA_MAX_STALENESS_SECS", 60 * 60))
+# אחרי רענון ברקע שנכשל (למשל 429 מ-Sheets) לא מנסים שוב לפני שעובר הזמן הזה
+REVALIDATE_COOLOFF_SECS = int(os.environ.get("REVALIDATE_COOLOFF_SECS", 60))
+SNAPSHOT_PATH   = os.environ.get("SNAPSHOT_PATH",
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data_snapshot.sqlite"))
+SNAPSHOT_FORMAT = 3  # להעלות כשמבנה הקובץ משתנה – קובץ בפורמט אחר פשוט לא נטען
+
+
+def _data_version(df_users: pd.DataFrame, df_actions: pd.DataFrame, admin_ids: list,
+                  df_content: pd.DataFrame) -> str:
+    """חותמת גרסה לפי תוכן – נתונים זהים = אותה גרסה."""
+    h = hashlib.sha1()
+    for df in (df_users, df_actions, df_content):
+        h.update(json.dumps(list(map(str, df.columns)), ensure_ascii=False).encode())
+        h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    h.update(json.dumps(admin_ids, ensure_ascii=False).encode())
+    return h.hexdigest()[:12]
+
+
+def _write_table(con, name: str, df: pd.DataFrame):
+    # עמודות ללא טיפוס – SQLite שומר כל ערך כמו שהוא (int / float / str), בלי המרות
+    if df.columns.empty: return
+    cols = ", ".join('"{}"'.format(str(c).replace('"', '""')) for c in df.columns)
+    con.execute(f'CREATE TABLE "{name}" ({cols})')
+    con.executemany(f'INSERT INTO "{name}" VALUES ({", ".join("?" * len(df.columns))})',
+                    df.itertuples(index=False, name=None))
+
+
+def _read_table(con, name: str) -> pd.DataFrame:
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone():
+        return pd.DataFrame()
+    return pd.read_sql_query(f'SELECT * FROM "{name}"', con)
+
+
+def _snapshot_users(df: pd.DataFrame) -> pd.DataFrame:
+    """טבלת המשתמשים לדיסק: בלי סיסמאות, ת"ז וכתובות – התחברות ממתינה לטבלה המלאה מ-Sheets."""
+    return df.drop(columns=[*DERIVED_COLS, *SENSITIVE_COLS, *PRIVATE_COLS], errors="ignore")
+
+
+def _snapshot_meta(data: dict) -> dict:
+    sync = _get_actions_sync()
+    with sync["lock"]:  # מצב הסנכרון נשמר רק אם הוא תואם בדיוק לפעולות שבתמונה
+        sync_meta = ({k: sync[k] for k in ("header", "rows", "anchor", "full_at")}
+                     if sync["df"] is data["actions"] else None)
+    return {"format": SNAPSHOT_FORMAT, "version": data["version"], "synced_at": data["synced_at"],
+            "synced": data["synced"], "admins": data["admins"], "sync": sync_meta}
+
+
+def _save_snapshot(data: dict):
+    """כותב את הנתונים לקובץ SQLite מקומי (כתיבה לקובץ זמני + החלפה אטומית)."""
+    meta = _snapshot_meta(data)
+    tmp = f"{SNAPSHOT_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if os.path.exists(tmp): os.remove(tmp)
+    os.close(os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))  # רק לבעלים; SQLite יוצר את ה-journal באותן הרשאות
+    con = sqlite3.connect(tmp)
+    try:
+        with con:
+            con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            con.executemany("INSERT INTO meta VALUES (?, ?)",
+                            [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+            _write_table(con, "users",   _snapshot_users(data["users"]))
+            _write_table(con, "actions", data["actions"].drop(columns=DERIVED_COLS, errors="ignore"))
+            _write_table(con, "content", data["content"])
+    finally:
+        con.close()
+    os.replace(tmp, SNAPSHOT_PATH)
+
+
+def _touch_snapshot(data: dict):
+    """התוכן לא השתנה – מעדכנים רק את חותמת הזמן ומצב הסנכרון בקובץ הקיים."""
+    meta = _snapshot_meta(data)
+    con  = sqlite3.connect(SNAPSHOT_PATH)
+    try:
+        with con:
+            con.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                            [(k, json.dumps(meta[k], ensure_ascii=False)) for k in ("synced_at", "synced", "sync")])
+    finally:
+        con.close()
+
+
+def _load_snapshot():
+    """טוען snapshot מהדיסק; None אם אין קובץ, הפורמט לא תואם או שהקובץ פגום."""
+    if not os.path.exists(SNAPSHOT_PATH): return None
     try:
-        admin_ids = pd.DataFrame(sh.worksheet("מנהלים").get_all_records()).iloc[:,0].astype(str).tolist()
+        con = sqlite3.connect(f"file:{SNAPSHOT_PATH}?mode=ro", uri=True)
+        try:
+            meta = {k: json.loads(v) for k, v in con.execute("SELECT key, value FROM meta")}
+            if meta.get("format") != SNAPSHOT_FORMAT: return None
+            df_users   = _normalize_users(_read_table(con, "users"))
+            df_actions = _normalize_actions(_read_table(con, "actions"))
+            df_content = _read_table(con, "content")
+        finally:
+            con.close()
+    except Exception:
+        return None
+    # ממשיכים את הסנכרון המצטבר מהנקודה שבה ה-snapshot נשמר
+    # מדדי המערכת לא נשמרים בקובץ – מחושבים פעם אחת בטעינה ומשם נצברים
+    kpi  = _kpi_chunk(df_actions)
+    sync = _get_actions_sync()
+    with sync["lock"]:
+        if sync["df"] is None and meta["sync"]:
+            sync.update(meta["sync"], df=df_actions, kpi=kpi)
+    # בטבלת המשתמשים מהדיסק חסרות העמודות הרגישות – גרסה משלה, כך שה-caches נבנים מחדש כשהטבלה המלאה מגיעה,
+    # ו-users_from_disk עוצר התחברויות עד אז
+    return {"users": df_users, "actions": df_actions, "kpi": kpi, "admins": meta["admins"], "content": df_content,
+            "users_from_disk": True, "version": f"{meta['version']}~disk", "synced_at": meta["synced_at"],
+            "synced": meta.get("synced") or dict.fromkeys(DATASETS, meta["synced_at"])}
+
+
+@st.cache_resource
+def _get_data_store():
+    """הנתונים הנוכחיים בזיכרון התהליך – משותפים לכל הסשנים, לא מועתקים בכל rerun."""
+    return {"lock": threading.Lock(), "refresh_lock": threading.Lock(), "data": None,
+            "refreshing": False, "pending": set(), "saved_version": None, "refresh_requests": {},
+            "failed_at": 0.0}
+
+
+def _publish(store: dict, data: dict):
+    """החלפה אטומית של התמונה; ה-snapshot נכתב מחדש רק כשהתוכן השתנה."""
+    store["data"] = data
+    try:
+        if store["saved_version"] == data["version"] and os.path.exists(SNAPSHOT_PATH):
+            _touch_snapshot(data)
+        else:
+            _save_snapshot(data)
+            store["saved_version"] = data["version"]
     except Exception:
-        admin_ids = []
-    return df_users, df_actions, admin_ids
+        log.exception("saving the data snapshot failed")
+
+
+def _revalidate_in_background(store: dict, datasets=None):
+    """טעינה מחדש ב-thread נפרד; המשתמשים ממשיכים לקבל את התמונה הקיימת.
+
+    datasets=None – רענון TTL מלא, מיותר אם כבר רץ רענון.
+    רשימת datasets – מצטרפת לסבב הבא של ה-thread (בקשות שמגיעות בזמן טעינה מאוחדות לסבב אחד).
+    אחרי כישלון אין ניסיון חדש במשך REVALIDATE_COOLOFF_SECS – ממשיכים להגיש את התמונה הקיימת.
+    """
+    with store["refresh_lock"]:
+        if time.time() - store["failed_at"] < REVALIDATE_COOLOFF_SECS: return
+        if store["refreshing"] and datasets is None: return
+        store["pending"].update(datasets or DATASETS)
+        if store["refreshing"]: return
+        store["refreshing"] = True
+
+    def run():
+        idle = False
+        try:
+            while True:
+                with store["refresh_lock"]:
+                    datasets, store["pending"] = store["pending"], set()
+                    if not datasets:
+                        store["refreshing"] = False
+                        idle = True
+                        return
+                _publish(store, _fetch_data(datasets, store["data"]))
+        except Exception:
+            log.exception("background data refresh failed; retrying in %ss", REVALIDATE_COOLOFF_SECS)
+            store["failed_at"] = time.time()
+        finally:
+            if not idle:  # יציאה בשגיאה (כל חריגה) – הבקשות שהצטרפו נזנחות והדגל לא נשאר תקוע
+                with store["refresh_lock"]:
+                    store["pending"] = set()
+                    store["refreshing"] = False
+
+    threading.Thread(target=run, name="data-revalidate", daemon=True).start()
+
+
+REFRESH_COOLDOWN_SECS = 60  # רענון ידני – פעם בדקה לכל משתמש
+
+
+def request_refresh(uid: str, datasets=("users", "actions")) -> int:
+    """רענון ידני של מערכי נתונים מסוימים בלבד; שאר ה-caches לא נפגעים.
+
+    מחזיר 0 אם הבקשה התקבלה, אחרת כמה שניות נותרו עד שהמשתמש יכול לרענן שוב.
+    """
+    store = _get_data_store()
+    now   = time.time()
+    with store["refresh_lock"]:
+        left = store["refresh_requests"].get(uid, 0) + REFRESH_COOLDOWN_SECS - now
+        if left > 0: return int(left) + 1
+        store["refresh_requests"][uid] = now
+    _revalidate_in_background(store, datasets)
+    return 0
+
+
+def wait_for_refresh(timeout: float = 10.0):
+    """ממתין (עד timeout) שהרענון ברקע יסתיים."""
+    store    = _get_data_store()
+    deadline = time.time() + timeout
+    while store["refreshing"] and time.time() < deadline:
+        time.sleep(0.1)
+
+
+def get_data_snapshot() -> dict:
+    """התמונה הנוכחית: users / actions / admins / content + version + synced_at.
+
+    Stale-while-revalidate: אחרי DATA_TTL_SECS מוגשת התמונה הקיימת והרענון רץ ברקע.
+    רק כשאין נתונים כלל, או שהם ישנים מ-DATA_MAX_STALENESS_SECS, הבקשה ממתינה ל-Sheets.
+    תהליך חדש טוען מיד את ה-snapshot שעל הדיסק.
+    """
+    store = _get_data_store()
+    data  = store["data"]
+    if data is None:
+        with store["lock"]:
+            if store["data"] is None:
+                store["data"] = _load_snapshot()
+                if store["data"] is not None:
+                    store["saved_version"] = store["data"]["version"]
+                    _revalidate_in_background(store, ("users",))  # הסיסמאות והפרטים האישיים לא נשמרים בדיסק
+            data = store["data"]
+    age = time.time() - data["synced_at"] if data is not None else None
+    if age is not None and age < DATA_MAX_STALENESS_SECS:
+        if age >= DATA_TTL_SECS:
+            _revalidate_in_background(store)
+        return data
+    with store["lock"]:
+        data = store["data"]
+        if data is None or time.time() - data["synced_at"] >= DATA_MAX_STALENESS_SECS:
+            data = _fetch_data()
+            _publish(store, data)
+        return data
 
 
-@st.cache_data(ttl=600)
 def get_cms_content():
+    """דפי התוכן – מגיעים מאותה טעינת batch של שאר הנתונים."""
+    try:
+        data = get_data_snapshot()
+        return _cms_content(data["version"], data["content"])
+    except Exception:
+        return _cms_content("", pd.DataFrame())
+
+
+@st.cache_data(max_entries=4)
+def _cms_content(version: str, _df_content: pd.DataFrame) -> dict:
     defaults = {
         "קצת עלינו": "**שיעבודא פון** – מערכת ניהול חשבונות מתקדמת.\n\nאנחנו מספקים שירות מהיר, בטוח ושקוף.",
         "צור קשר":   "לפניות ותמיכה:\n📞 054-0000000\n📧 support@shiabudefon.com",
         "תקנון":     "השימוש במערכת כפוף לתנאי השימוש. כל הפעולות מבוצעות בצורה מאובטחת.",
     }
-    try:
-        sh  = get_client().open_by_key(SPREADSHEET_ID)
-        df  = pd.DataFrame(sh.worksheet("תוכן").get_all_records())
-        for _, row in df.iterrows():
-            k,v = str(row.get("כותרת","")).strip(), str(row.get("תוכן","")).strip()
-            if k and v: defaults[k] = v
-    except Exception:
-        pass
+    for _, row in _df_content.iterrows():
+        k,v = str(row.get("כותרת","")).strip(), str(row.get("תוכן","")).strip()
+        if k and v: defaults[k] = v
     return defaults
 
 
 # ============================
 # עיבוד נתונים
 # ============================
-def process_user_actions(df_actions: pd.DataFrame, user_id: str) -> pd.DataFrame:
+@st.cache_resource(max_entries=2)
+def get_user_action_index(version: str, _df_actions: pd.DataFrame) -> dict:
+    """uid → מיקומי השורות שלו (כמקור או כיעד) ב-df_actions, בסדר עולה.
+
+    נבנה פעם אחת לכל גרסת נתונים, כך ששליפה של משתמש עולה O(השורות שלו).
+    """
+    if _df_actions.empty: return {}
+    pos  = np.arange(len(_df_actions))
+    legs = pd.DataFrame({
+        "uid": np.concatenate([_df_actions["מספר משתמש מקור"].to_numpy(),
+                               _df_actions["מספר משתמש יעד"].to_numpy()]),
+        "pos": np.concatenate([pos, pos]),
+    }).drop_duplicates().sort_values("pos", kind="stable")
+    legs_pos = legs["pos"].to_numpy()
+    return {uid: legs_pos[ix] for uid, ix in legs.groupby("uid", sort=False).indices.items()}
+
+
+def process_user_actions(df_actions: pd.DataFrame, user_id: str, index: dict | None = None) -> pd.DataFrame:
     if df_actions.empty: return pd.DataFrame()
-    df = df_actions.copy()
-    df["מספר משתמש מקור"] = df["מספר משתמש מקור"].astype(str)
-    df["מספר משתמש יעד"]  = df["מספר משתמש יעד"].astype(str)
-    uid  = str(user_id)
-    mask = (df["מספר משתמש מקור"] == uid) | (df["מספר משתמש יעד"] == uid)
-    my   = df[mask].copy()
+    uid = str(user_id)
+    if index is not None:
+        rows = index.get(uid)
+        if rows is None: return pd.DataFrame()
+        my = df_actions.iloc[rows]
+    else:
+        my = df_actions[(df_actions["מספר משתמש מקור"] == uid) | (df_actions["מספר משתמש יעד"] == uid)]
     if my.empty: return pd.DataFrame()
+    return pd.concat([my.reset_index(drop=True), _enrich_actions(my, uid)], axis=1)
+
+
+HISTORY_COLS = ["תאריך", "שעה", "סכום", "סטטוס", "כיוון", "תיאור", "שם מקור", "שם יעד"]
+
+
+@st.cache_resource(max_entries=32)
+def get_user_actions(version: str, uid: str, _df_actions: pd.DataFrame) -> pd.DataFrame:
+    """הפעולות המועשרות של uid, כולל עמודות התצוגה של הכרטיסים – נבנה פעם אחת לכל גרסה.
+
+    הטבלה משותפת לכל הסשנים של המשתמש – אין לשנות אותה במקום.
+    """
+    my = process_user_actions(_df_actions, uid, get_user_action_index(version, _df_actions))
+    if my.empty: return my
+    for col in HISTORY_COLS:
+        if col not in my.columns: my[col] = ""
+    return pd.concat([my, card_fields(my)], axis=1)
 
-    def _s(v):
-        s = str(v).strip()
-        return s if s not in ('', 'nan', 'None', '0') else ''
-
-    def enrich(row):
-        is_sender = str(row["מספר משתמש מקור"]) == uid
-        try:    amount = float(row.get("סכום",0))
-        except: amount = 0
-        direction = "חובה" if is_sender else "זכות"
-        net  = -amount if is_sender else amount
-        if is_sender:
-            name, uid_t = _s(row.get('שם יעד','')), _s(row.get('מספר משתמש יעד',''))
-            if name and uid_t:   desc = f"העברה אל {name} ({uid_t})"
-            elif name:           desc = f"העברה אל {name}"
-            elif uid_t:          desc = f"העברה אל משתמש {uid_t}"
-            else:                desc = "העברה יוצאת"
-        else:
-            name, uid_s = _s(row.get('שם מקור','')), _s(row.get('מספר משתמש מקור',''))
-            if name and uid_s:   desc = f"התקבל מ-{name} ({uid_s})"
-            elif name:           desc = f"התקבל מ-{name}"
-            elif uid_s:          desc = f"התקבל ממשתמש {uid_s}"
-            else:                desc = "קבלת העברה"
-        return pd.Series({"כיוון": direction, "סכום נטו": net, "תיאור": desc})
 
-    enriched = my.apply(enrich, axis=1)
-    return pd.concat([my.reset_index(drop=True), enriched.reset_index(drop=True)], axis=1)
+@st.cache_resource(max_entries=2)
+def get_admin_ledger(version: str, _df_actions: pd.DataFrame) -> pd.DataFrame:
+    """כל הפעולות במבט המערכת: פעולת מנהל / הפקדה בזכות, העברה בין משתמשים בחובה – נבנה פעם אחת לכל גרסה.
+
+    הטבלה משותפת לכל סשני המנהלים – אין לשנות אותה במקום.
+    """
+    if _df_actions.empty: return pd.DataFrame()
+    ledger = _df_actions.reset_index(drop=True)
+    ledger = pd.concat([ledger, _enrich_ledger(ledger)], axis=1)
+    for col in HISTORY_COLS:
+        if col not in ledger.columns: ledger[col] = ""
+    return pd.concat([ledger, card_fields(ledger)], axis=1)
+
+
+def _clean_text(df: pd.DataFrame, col: str) -> pd.Series:
+    """טקסט מנוקה לתיאור; ערכי EMPTY_VALUES נחשבים ריקים."""
+    if col not in df.columns: return pd.Series("", index=df.index)
+    s = df[col].astype(str).fillna("").str.strip()
+    return s.where(~s.isin(EMPTY_VALUES), "")
+
+
+def _enrich_actions(my: pd.DataFrame, uid: str) -> pd.DataFrame:
+    """כיוון / סכום נטו / תיאור לפעולות של uid – מעבר וקטורי אחד על העמודות."""
+    is_sender = (my["מספר משתמש מקור"] == uid).to_numpy()
+    amount    = (my["סכום_num"] if "סכום_num" in my.columns
+                 else _to_float(my["סכום"]) if "סכום" in my.columns
+                 else pd.Series(0.0, index=my.index)).to_numpy()
+
+    def _desc(name, other, both, name_only, uid_only, empty):
+        has_n, has_u = (name != "").to_numpy(), (other != "").to_numpy()
+        return np.select(
+            [has_n & has_u, has_n, has_u],
+            [(both + name + " (" + other + ")").to_numpy(), (name_only + name).to_numpy(),
+             (uid_only + other).to_numpy()],
+            default=empty)
+
+    out_desc = _desc(_clean_text(my, "שם יעד"), _clean_text(my, "מספר משתמש יעד"),
+                     "העברה אל ", "העברה אל ", "העברה אל משתמש ", "העברה יוצאת")
+    in_desc  = _desc(_clean_text(my, "שם מקור"), _clean_text(my, "מספר משתמש מקור"),
+                     "התקבל מ-", "התקבל מ-", "התקבל ממשתמש ", "קבלת העברה")
+    return pd.DataFrame({
+        "כיוון":    np.where(is_sender, "חובה", "זכות"),
+        "סכום נטו": np.where(is_sender, -amount, amount),
+        "תיאור":    np.where(is_sender, out_desc, in_desc),
+    })
+
+
+def _enrich_ledger(df: pd.DataFrame) -> pd.DataFrame:
+    """כיוון / סכום נטו / תיאור לכל הפעולות, וקטורית; שם חסר מוחלף במספר המשתמש.
+
+    סכום נטו הוא מבט המערכת: הפקדה / פעולת מנהל נכנסת, העברה בין משתמשים לא משנה את הכסף במערכת (0).
+    כיוון נשאר לפי סוג הפעולה – בשביל הסינונים והפילוח.
+    """
+    src = _clean_text(df, "שם מקור")
+    src = src.where(src != "", _clean_text(df, "מספר משתמש מקור"))
+    dst = _clean_text(df, "שם יעד")
+    dst = dst.where(dst != "", _clean_text(df, "מספר משתמש יעד"))
+    credit = (src == "").to_numpy()
+    if "סטטוס_סוג" in df.columns: credit = credit | (df["סטטוס_סוג"] == "פעולת מנהל").to_numpy()
+    amount = (df["סכום_num"] if "סכום_num" in df.columns
+              else _to_float(df["סכום"]) if "סכום" in df.columns
+              else pd.Series(0.0, index=df.index)).to_numpy()
+    return pd.DataFrame({
+        "כיוון":    np.where(credit, "זכות", "חובה"),
+        "סכום נטו": np.where(credit, amount, 0.0),
+        "תיאור":    np.where(src != "", ("העברה מ-" + src + " אל " + dst).to_numpy(), ("הפקדה אל " + dst).to_numpy()),
+    })
+
+
+def month_start(months_back: int = 0) -> pd.Timestamp:
+    return pd.Timestamp.now().normalize().replace(day=1) - pd.offsets.MonthBegin(months_back)
+
+
+def month_range(months_back: int = 0) -> tuple:
+    start = month_start(months_back)
+    return start, start + pd.offsets.MonthBegin(1)
+
+
+@st.cache_resource(max_entries=32)
+def get_date_index(version: str, scope: str, _df: pd.DataFrame) -> dict:
+    """תאריך_dt ממוין לטבלת הפעולות של scope (uid, או '*' למנהל) – נבנה פעם אחת לכל גרסה.
+
+    order – מיקומי השורות בסדר כרונולוגי (שורות בלי תאריך בסוף); dt – הזמנים באותו סדר.
+    """
+    dt = (_df["תאריך_dt"].to_numpy(dtype="datetime64[ns]") if "תאריך_dt" in _df.columns
+          else np.full(len(_df), np.datetime64("NaT", "ns")))
+    order = np.argsort(dt, kind="stable")
+    return {"order": order, "dt": dt[order]}
+
+
+def date_rows(index: dict, start, end) -> np.ndarray:
+    """מיקומי השורות עם start <= תאריך < end, בסדר כרונולוגי – חיפוש בינארי, בלי מעבר על הטבלה."""
+    lo, hi = np.searchsorted(index["dt"], [np.datetime64(pd.Timestamp(start), "ns"),
+                                           np.datetime64(pd.Timestamp(end), "ns")])
+    return index["order"][lo:hi]
+
+
+BALANCE_CHART_POINTS = 300  # תקציב נקודות לגרף מגמת היתרה
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: אינדקסי n_out נקודות ששומרות על צורת הגרף (כולל הראשונה והאחרונה)."""
+    n = len(x)
+    if n_out >= n or n_out < 3: return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)  # n_out-2 דליים בין הנקודה הראשונה לאחרונה
+    keep, a = [0], 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < len(edges): nx, ny = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:                  nx, ny = x[-1], y[-1]
+        # הנקודה בדלי שיוצרת את המשולש הגדול ביותר עם הנקודה הקודמת שנבחרה וממוצע הדלי הבא
+        area = np.abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+        a = lo + int(area.argmax())
+        keep.append(a)
+    keep.append(n - 1)
+    return np.asarray(keep)
+
+
+@st.cache_resource(max_entries=32)
+def get_balance_series(version: str, scope: str, _df: pd.DataFrame) -> pd.DataFrame:
+    """יתרה מצטברת בסוף כל יום לטבלת הפעולות של scope, מדוללת ב-LTTB ל-BALANCE_CHART_POINTS נקודות.
+
+    פעולות בלי תאריך לא נכנסות לסדרה.
+    """
+    dt  = _df["תאריך_dt"] if "תאריך_dt" in _df.columns else pd.Series(pd.NaT, index=_df.index)
+    net = pd.Series(np.nan_to_num(_df["סכום נטו"].to_numpy(dtype=float)), index=_df.index)
+    daily = net[dt.notna()].groupby(dt[dt.notna()].dt.normalize()).sum().cumsum()
+    if daily.empty: return pd.DataFrame({"תאריך": pd.Series(dtype="datetime64[ns]"), "יתרה מצטברת": []})
+    days = daily.index.to_numpy(dtype="datetime64[ns]")
+    keep = lttb(days.astype(np.int64).astype(float), daily.to_numpy(), BALANCE_CHART_POINTS)
+    return pd.DataFrame({"תאריך": days[keep], "יתרה מצטברת": daily.to_numpy()[keep]})
+
+HIST_STATUS = {"זכות": ("כיוון", "זכות"), "חובה": ("כיוון", "חובה"),
+               "כושלות": ("סטטוס_סוג", "כושלת"), "פעולות מנהל": ("סטטוס_סוג", "פעולת מנהל")}
+# מיון → (עמודות, כיוון); שוויון נשבר לטובת הפעולה החדשה
+HIST_SORTS = {"תאריך ↓": (["dt"], [False]), "תאריך ↑": (["dt"], [True]),
+              "סכום ↓": (["amt", "dt"], [False, False]), "סכום ↑": (["amt", "dt"], [True, False]),
+              "זכויות": (["credit", "dt"], [False, False]), "חובות": (["credit", "dt"], [True, False])}
+
+
+def filter_history_rows(df: pd.DataFrame, version: str, scope: str, search_text: str = "", period=None,
+                        status_filter=(), min_amt: float = 0.0, max_amt: float = 0.0) -> np.ndarray:
+    """מיקומי השורות ב-df שעוברות את סינוני עובר ושב, בסדר עולה."""
+    rows = np.arange(len(df))
+    if search_text: rows = search_rows(get_search_index(version, scope, df), search_text)
+    if period:      rows = np.intersect1d(rows, date_rows(get_date_index(version, scope, df), *period))
+    keep  = np.ones(len(rows), dtype=bool)
+    conds = [HIST_STATUS[s] for s in status_filter if s in HIST_STATUS]
+    if conds and "הכל" not in status_filter:
+        keep = functools.reduce(np.logical_or, [df[col].to_numpy()[rows] == val for col, val in conds])
+    amt   = np.abs(df["סכום_num"].to_numpy(dtype=float)[rows])
+    keep &= (amt >= min_amt) & ((max_amt == 0.0) | (amt <= max_amt))
+    return rows[keep]
+
+
+def sort_history_rows(df: pd.DataFrame, rows: np.ndarray, sort_opt: str) -> np.ndarray:
+    """rows בסדר התצוגה של sort_opt (שורות בלי תאריך בסוף)."""
+    by, asc = next((v for k, v in HIST_SORTS.items() if k in sort_opt), HIST_SORTS["תאריך ↓"])
+    keys = pd.DataFrame({"dt": df["תאריך_dt"].to_numpy()[rows],
+                         "amt": np.abs(df["סכום_num"].to_numpy(dtype=float)[rows]),
+                         "credit": df["כיוון"].to_numpy()[rows] == "זכות"})
+    return rows[keys.sort_values(by, ascending=asc, kind="stable", na_position="last").index.to_numpy()]
+
+
+RECON_TOLERANCE = 0.005  # הפרש קטן מאגורה – עיגול, לא אי-התאמה
+
+
+@st.cache_resource(max_entries=2)
+def get_reconciliation(version: str, _df_users: pd.DataFrame, _kpi: dict) -> pd.DataFrame:
+    """התאמת יתרות: היתרה השמורה ב"משתמשים" מול היתרה לפי הפעולות (מצבר ה-ledger) – רק השורות שלא תואמות.
+
+    משתמש שמופיע בפעולות ולא ב"משתמשים" מדווח עם יתרה שמורה ריקה; מספרי EMPTY_VALUES (כמו "0") אינם משתמש.
+    attrs["checked"] – כמה משתמשים נבדקו.
+    """
+    users  = _df_users.drop_duplicates("מספר משתמש").set_index("מספר משתמש") if not _df_users.columns.empty else pd.DataFrame()
+    stored = users["יתרה_num"] if "יתרה_num" in users.columns else pd.Series(np.nan, index=users.index, dtype=float)
+    stored = stored[~stored.index.astype(str).isin(EMPTY_VALUES)]
+    uids   = stored.index.union(_kpi["ledger"].index)
+    stored = stored.reindex(uids)
+    ledger = _kpi["ledger"].reindex(uids, fill_value=0.0)
+    diff   = stored.fillna(0.0) - ledger
+    bad    = (diff.abs() > RECON_TOLERANCE) | stored.isna()
+    names  = users["שם משתמש"].reindex(uids).fillna("") if "שם משתמש" in users.columns else pd.Series("", index=uids)
+    out = pd.DataFrame({"מספר משתמש": uids, "שם משתמש": names.to_numpy(), "יתרה שמורה": stored.to_numpy(),
+                        "יתרה לפי פעולות": ledger.to_numpy(), "הפרש": diff.to_numpy()})[bad.to_numpy()]
+    out = out.iloc[np.argsort(-out["הפרש"].abs().to_numpy(), kind="stable")].reset_index(drop=True)
+    out.attrs["checked"] = len(uids)
+    return out
+
+
+AGG_COLS = ["יתרה", "הכנסות", "הוצאות", "פעולות", "זכויות", "חובות", "כושלות",
+            "אחרונה_כיוון", "אחרונה_סכום", "אחרונה_תאריך"]
+
+
+def _has_actions(df_actions: pd.DataFrame) -> bool:
+    return not df_actions.empty and "סכום_num" in df_actions.columns
+
+
+def _action_legs(df_actions: pd.DataFrame) -> pd.DataFrame:
+    """רגל לכל צד של פעולה: המקור בחובה, היעד בזכות.
+
+    פעולה של משתמש לעצמו נספרת פעם אחת, כחובה – כמו ב-_enrich_actions.
+    """
+    if not _has_actions(df_actions):
+        return pd.DataFrame({"uid": pd.Series(dtype=str), "pos": pd.Series(dtype=int), "net": pd.Series(dtype=float),
+                             "credit": pd.Series(dtype=bool), "failed": pd.Series(dtype=bool),
+                             "month": pd.Series(dtype="period[M]")})
+    src, dst = df_actions["מספר משתמש מקור"].to_numpy(), df_actions["מספר משתמש יעד"].to_numpy()
+    amount   = df_actions["סכום_num"].to_numpy()
+    pos      = np.arange(len(df_actions))
+    incoming = dst != src
+    legs = pd.DataFrame({
+        "uid":    np.concatenate([src, dst[incoming]]),
+        "pos":    np.concatenate([pos, pos[incoming]]),
+        "net":    np.concatenate([-amount, amount[incoming]]),
+        "credit": np.concatenate([np.zeros(len(pos), bool), np.ones(incoming.sum(), bool)]),
+    })
+    rows = legs["pos"].to_numpy()
+    legs["failed"] = df_actions["סטטוס_סוג"].to_numpy()[rows] == "כושלת"
+    legs["month"]  = df_actions["תאריך_dt"].dt.to_period("M").array.take(rows)
+    return legs
+
+
+@st.cache_resource(max_entries=2)
+def get_user_aggregates(version: str, _df_users: pd.DataFrame, _df_actions: pd.DataFrame) -> dict:
+    """סיכומים לכל המשתמשים – מעבר groupby וקטורי אחד לכל גרסת נתונים.
+
+    users   – לפי uid: יתרה, הכנסות/הוצאות, מספרי פעולות ופרטי הפעולה האחרונה.
+    monthly – לפי (uid, חודש): הכנסות / הוצאות / פעולות.
+    מדדי המערכת כולה נצברים בנפרד בזמן הסנכרון (kpi_summary).
+    """
+    legs = _action_legs(_df_actions)
+    legs["in"], legs["out"] = legs["net"].clip(lower=0), (-legs["net"]).clip(lower=0)
+
+    g     = legs.groupby("uid", sort=False)
+    users = g.agg(הכנסות=("in", "sum"), הוצאות=("out", "sum"), פעולות=("pos", "size"),
+                  זכויות=("credit", "sum"), כושלות=("failed", "sum"))
+    users["חובות"] = users["פעולות"] - users["זכויות"]
+    # הפעולה האחרונה = השורה המאוחרת ביותר בגיליון שבה המשתמש מופיע
+    last = legs.loc[g["pos"].idxmax()].set_index("uid")
+    users["אחרונה_כיוון"] = np.where(last["credit"].reindex(users.index, fill_value=False), "זכות", "חובה")
+    if _has_actions(_df_actions):
+        last_rows = _df_actions.iloc[last["pos"].to_numpy()]
+        users["אחרונה_סכום"]  = pd.Series(last_rows["סכום_num"].abs().to_numpy(), index=last.index)
+        users["אחרונה_תאריך"] = pd.Series(_str_col(last_rows.get("תאריך", pd.Series("", index=last_rows.index))).to_numpy(),
+                                           index=last.index)
+    else:
+        users["אחרונה_סכום"], users["אחרונה_תאריך"] = 0.0, ""
+
+    balances = (_df_users.drop_duplicates("מספר משתמש").set_index("מספר משתמש")["יתרה_num"]
+                if "יתרה_num" in _df_users.columns else pd.Series(dtype=float))
+    users = users.reindex(users.index.union(balances.index))
+    users["יתרה"] = balances.reindex(users.index).fillna(0.0)
+    num_cols = ["הכנסות", "הוצאות", "אחרונה_סכום"]
+    cnt_cols = ["פעולות", "זכויות", "חובות", "כושלות"]
+    users[num_cols] = users[num_cols].fillna(0.0)
+    users[cnt_cols] = users[cnt_cols].fillna(0).astype(int)
+    users[["אחרונה_כיוון", "אחרונה_תאריך"]] = users[["אחרונה_כיוון", "אחרונה_תאריך"]].fillna("")
+
+    monthly = legs.groupby(["uid", "month"]).agg(הכנסות=("in", "sum"), הוצאות=("out", "sum"),
+                                                 פעולות=("pos", "size"))
+    return {"users": users[AGG_COLS], "monthly": monthly}
+
+
+def user_summary(aggs: dict, uid: str, month: pd.Timestamp | None = None) -> dict:
+    """שורת הסיכום של uid (ברירות מחדל למשתמש ללא נתונים); עם month – גם הכנסות/הוצאות החודש."""
+    users = aggs["users"]
+    row   = (users.loc[uid].to_dict() if uid in users.index
+             else {**dict.fromkeys(AGG_COLS, 0), "אחרונה_כיוון": "", "אחרונה_תאריך": ""})
+    if month is not None:
+        key = (uid, pd.Period(month, "M"))
+        m   = aggs["monthly"].loc[key] if key in aggs["monthly"].index else None
+        row.update({f"{k}_חודש": (m[k] if m is not None else 0) for k in ("הכנסות", "הוצאות", "פעולות")})
+    return row
+
+
+_TOKEN_STRIP = "()[]{}\"',;:!?·|"  # סימנים שנחתכים מקצות מילות החיפוש
+
+
+@st.cache_resource(max_entries=32)
+def get_search_index(version: str, scope: str, _df: pd.DataFrame) -> dict:
+    """אינדקס חיפוש לטבלת הפעולות של scope (uid, '*' למנהל, או 'users') – נבנה פעם אחת לכל גרסה.
+
+    cols – לכל עמודה: הערכים השונים כטקסט מנורמל, ולכל ערך – מיקומי השורות שלו.
+    חיפוש עובר על הערכים השונים בלבד, גם אם כל ערך חוזר באלפי שורות.
+    """
+    cols = []
+    for c in _df.columns:
+        if c in DERIVED_COLS or c in SENSITIVE_COLS: continue
+        codes, uniq = pd.factorize(_df[c])
+        text   = pd.Index(uniq).astype(str).str.lower().to_numpy()
+        order  = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniq) + 1))
+        cols.append((text, [order[bounds[k]:bounds[k + 1]] for k in range(len(uniq))]))
+    return {"cols": cols}
+
+
+def _substring_rows(index: dict, q: str) -> np.ndarray:
+    found = [groups[k] for text, groups in index["cols"]
+             for k in np.flatnonzero(pd.Series(text, dtype=object).str.contains(q, regex=False).to_numpy())]
+    return np.unique(np.concatenate(found)) if found else np.array([], dtype=np.int64)
+
+
+def search_rows(index: dict, text: str) -> np.ndarray:
+    """מיקומי השורות שתואמות לחיפוש (תת-מחרוזת בערך של עמודה כלשהי), בסדר עולה.
+
+    כמה מילים – קודם הביטוי המדויק בתוך ערך אחד, ואם אין – שורות שבהן מופיעה כל אחת מהמילים (AND).
+    """
+    q = text.strip().lower()
+    terms = [t for t in (w.strip(_TOKEN_STRIP) for w in q.split()) if t]
+    if len(terms) <= 1: return _substring_rows(index, terms[0] if terms else q)
+    phrase = _substring_rows(index, q)
+    if len(phrase): return phrase
+    hits = _substring_rows(index, terms[0])
+    for t in terms[1:]:
+        if not len(hits): break
+        hits = np.intersect1d(hits, _substring_rows(index, t), assume_unique=True)
+    return hits
 
 
-def get_user_balance(df_users: pd.DataFrame, user_id: str) -> float:
-    df = df_users.copy()
-    df["מספר משתמש"] = df["מספר משתמש"].astype(str).str.strip()
-    row = df[df["מספר משתמש"] == str(user_id)]
-    if row.empty: return 0.0
-    try:    return float(row.iloc[0]["יתרה"])
-    except: return 0.0
+# ============================
+# ייצוא – נבנה רק כשהמשתמש לוחץ להוריד, נשמר לכל (scope, גרסה, סינון)
+# ============================
+EXPORT_CHUNK_ROWS  = 5000  # שורות לכל מקטע בזמן הכתיבה – הזיכרון לא גדל עם גודל הדוח
+EXPORT_WIDTH_ROWS  = 200   # רוחב העמודות נקבע לפי מדגם השורות הראשונות
+
+
+def _export_frame(df: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+    return df.iloc[rows].drop(columns=DERIVED_COLS, errors="ignore")
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_history_xlsx(scope: str, version: str, fkey: str, user_name: str,
+                       _df: pd.DataFrame, _rows: np.ndarray) -> bytes:
+    """קובץ Excel של השורות המסוננות – openpyxl במצב write-only, השורות נכתבות במקטעים."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    cols = [c for c in _df.columns if c not in DERIVED_COLS]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("פעולות")
+    # רוחב העמודות חייב להיקבע לפני השורה הראשונה – לפי הכותרת ומדגם מהנתונים
+    sample = _export_frame(_df, _rows[:EXPORT_WIDTH_ROWS]).astype(str).fillna("")
+    for i, c in enumerate(cols, 1):
+        max_len = int(max(len(str(c)), sample[c].str.len().max() if len(sample) else 0))
+        ws.column_dimensions[get_column_letter(i)].width = min(max_len + 4, 40)
+
+    def cell(value, **style):
+        ce = WriteOnlyCell(ws, value=value)
+        for k, v in style.items(): setattr(ce, k, v)
+        return ce
+
+    right = Alignment(horizontal="right")
+    ws.append([cell("💰 שיעבודא פון – דוח פעולות", font=Font(name="Arial", size=14, bold=True, color="1F3460"), alignment=right)])
+    ws.append([cell(f"משתמש: {user_name}  |  תאריך הפקה: {datetime.now().strftime('%d/%m/%Y %H:%M')}  |  סך פעולות: {len(_rows)}",
+                    font=Font(name="Arial", size=10, color="475569"), alignment=right)])
+    ws.append([])
+    hdr_fill, hdr_font = PatternFill("solid", fgColor="0F3460"), Font(name="Arial", bold=True, color="FFFFFF")
+    ws.append([cell(c, fill=hdr_fill, font=hdr_font, alignment=right) for c in cols])
+    for start in range(0, len(_rows), EXPORT_CHUNK_ROWS):
+        part = _export_frame(_df, _rows[start:start + EXPORT_CHUNK_ROWS]).astype(object)
+        for values in part.where(part.notna(), None).itertuples(index=False, name=None):
+            ws.append(values)
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _escape_col(col: pd.Series) -> pd.Series:
+    """תאים כטקסט מוכן ל-HTML (ריק במקום NaN)."""
+    col = col.astype(str).fillna("")
+    for ch, ent in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;")):
+        col = col.str.replace(ch, ent, regex=False)
+    return col
+
+
+def _html_report_chunks(df: pd.DataFrame, rows: np.ndarray):
+    """דוח ההדפסה כרצף מקטעי HTML – כל מקטע נבנה וקטורית מ-EXPORT_CHUNK_ROWS שורות."""
+    cols = [c for c in df.columns if c not in DERIVED_COLS]
+    ths  = "".join(f"<th>{html.escape(str(c))}</th>" for c in cols)
+    yield (f'<!DOCTYPE html><html dir="rtl"><head><meta charset="UTF-8">'
+           f'<style>body{{font-family:Arial;direction:rtl;padding:24px}}'
+           f'h2{{color:#0f3460}}table{{border-collapse:collapse;width:100%;font-size:12px}}'
+           f'th{{background:#0f3460;color:white;padding:8px;border:1px solid #ccc}}'
+           f'td{{padding:6px;border:1px solid #ddd}}'
+           f'@media print{{@page{{size:A4 landscape;margin:1cm}}button{{display:none}}}}'
+           f'</style></head><body>'
+           f'<h2>שיעבודא פון – דו"ח פעולות</h2>'
+           f'<p>תאריך הפקה: {datetime.now().strftime("%d/%m/%Y %H:%M")} | פעולות: {len(rows)}</p>'
+           f'<table><thead><tr>{ths}</tr></thead><tbody>')
+    for start in range(0, len(rows), EXPORT_CHUNK_ROWS):
+        part = _export_frame(df, rows[start:start + EXPORT_CHUNK_ROWS])
+        if part.empty: continue
+        bg   = np.where(part.get("כיוון", pd.Series("", index=part.index)).to_numpy() == "חובה", "#fff5f5", "#f0fff4")
+        tds  = ["<td>" + _escape_col(part[c]) + "</td>" for c in cols]
+        trs  = ("<tr style='background:" + pd.Series(bg, index=part.index) + "'>"
+                + tds[0].str.cat(tds[1:]) + "</tr>")
+        yield "".join(trs.tolist())
+    yield ('</tbody></table>'
+           '<br><button onclick="window.print()">🖨️ הדפס / שמור כ-PDF</button>'
+           '</body></html>')
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_history_html(scope: str, version: str, fkey: str, _df: pd.DataFrame, _rows: np.ndarray) -> bytes:
+    """דוח HTML להדפסה של השורות המסוננות (נשמר לכל scope / גרסה / סינון)."""
+    buf = BytesIO()
+    for chunk in _html_report_chunks(_df, _rows):
+        buf.write(chunk.encode("utf-8"))
+    return buf.getvalue()
 
 
 # ============================
-# FIX #8: כרטיסייה חכמה
+# גרפים – JSON מוכן לכל (scope, גרף, תצוגה, גרסה); ריצה חוזרת לא מחשבת ולא בונה Plotly מחדש
 # ============================
-def render_smart_card(row: pd.Series, highlight: str = ""):
-    status    = str(row.get("סטטוס","מוצלחת")).strip()
-    direction = str(row.get("כיוון","")).strip()
-
-    is_admin_op = "מנהל" in status
-    is_failed   = "כושל" in status or "נכשל" in status
-
-    if is_admin_op:
-        cls, badge_cls, badge_txt = "admin",  "badge-admin",  "פעולת מנהל"
-        dir_cls, dir_lbl = "dir-admin", "🛡️ פעולת מנהל"
-    elif is_failed:
-        cls, badge_cls, badge_txt = "failed", "badge-failed", "כושלת"
-        dir_cls, dir_lbl = "dir-debit",  "❌ כושלת"
-    elif direction == "זכות":
-        cls, badge_cls, badge_txt = "credit", "badge-ok",     "מוצלחת"
-        dir_cls, dir_lbl = "dir-credit", "⬆️ זכות"
-    else:
-        cls, badge_cls, badge_txt = "debit",  "badge-ok",     "מוצלחת"
-        dir_cls, dir_lbl = "dir-debit",  "⬇️ חובה"
+def _bar_fig(df: pd.DataFrame):
+    df  = df.tail(20)
+    net = df["סכום נטו"].fillna(0)
+    df  = df.assign(**{"סכום נטו": net, "צבע": np.where(net >= 0, "הכנסה", "הוצאה")})
+    fig = px.bar(df, x="תאריך", y="סכום נטו", color="צבע",
+                 color_discrete_map={"הכנסה":"#22c55e","הוצאה":"#ef4444"})
+    style_fig(fig, height=280)
+    fig.update_layout(xaxis_title="תאריך", yaxis_title="₪")
+    return fig
 
-    try:    amount_str = f"₪{abs(float(row.get('סכום', 0))):,.0f}"
-    except: amount_str = "₪-"
 
-    # תיאור נקי: הסר מספרי סוגריים לשורה נפרדת
-    raw_desc = str(row.get("תיאור", row.get("הערה", "")))
-    uid_part = re.search(r'\(([^)]+)\)', raw_desc)
-    uid_badge = f'<span style="direction:ltr;background:#f1f5f9;border-radius:6px;padding:1px 7px;font-size:0.7rem;color:#64748b;font-family:monospace;margin-right:6px">{uid_part.group(1)}</span>' if uid_part else ""
-    clean_desc = re.sub(r'\s*\([^)]+\)', '', raw_desc).strip()
-    if highlight.strip():
-        hl = re.escape(highlight.strip())
-        clean_desc = re.sub(f'({hl})', r'<mark style="background:#fef9c3;padding:0 2px;border-radius:3px">\1</mark>',
-                            clean_desc, flags=re.IGNORECASE)
+def _pie_fig(df: pd.DataFrame):
+    if "שם יעד" not in df.columns: return None
+    debits = df[df["כיוון"]=="חובה"]
+    if debits.empty: return None
+    # "שם יעד" קטגוריאלי (CATEGORY_COLS) – רק יעדים שמופיעים בפועל
+    pie_df = debits.groupby("שם יעד", observed=True)["סכום_num"].sum().reset_index()
+    pie_df.columns = ["שם","סכום"]
+    pie_df = pie_df[pie_df["שם"].str.strip()!=""]
+    fig = px.pie(pie_df, names="שם", values="סכום",
+                 title="פילוח הוצאות לפי יעד", hole=0.4,
+                 color_discrete_sequence=px.colors.sequential.Blues_r)
+    return style_fig(fig, height=300)
+
+
+def _line_fig(line_df: pd.DataFrame):
+    if line_df.empty: return None
+    fig = px.line(line_df, x="תאריך", y="יתרה מצטברת",
+                  markers=len(line_df) <= 60, color_discrete_sequence=["#0f3460"])
+    style_fig(fig, height=300)
+    fig.update_layout(yaxis_title="₪")
+    return fig
 
-    after_raw = row.get("יתרה לאחר פעולה", row.get("יתרה", ""))
-    date_val  = str(row.get("תאריך", ""))
-    time_val  = str(row.get("שעה",   ""))
-    phone     = str(row.get("טלפון", row.get("מבצע", "")))
 
-    try:    after_str = f"₪{float(after_raw):,.2f}" if str(after_raw).strip() not in ("","nan","None") else ""
-    except: after_str = ""
+@st.cache_data(max_entries=64, show_spinner=False)
+def chart_json(scope: str, chart: str, view: str, version: str, _df: pd.DataFrame, period=None) -> str:
+    """JSON של גרף מעוצב ("bar" / "pie" / "line"), או "" כשאין נתונים. period – טווח תאריכים לתצוגת חודש."""
+    if chart == "bar":
+        if period is not None:
+            _df = _df.iloc[np.sort(date_rows(get_date_index(version, scope, _df), *period))]
+        fig = _bar_fig(_df) if not _df.empty and "תאריך" in _df.columns else None
+    elif chart == "pie":
+        fig = _pie_fig(_df)
+    else:
+        fig = _line_fig(get_balance_series(version, scope, _df))
+    return fig.to_json() if fig is not None else ""
 
-    after_html = f'<div class="c-sub">יתרה לאחר: <span style="direction:ltr;display:inline-block">{after_str}</span></div>' if after_str else ""
-    phone_html = f'<div class="c-phone"><span style="direction:ltr;display:inline-block">{phone}</span></div>' if phone.strip() and phone != "nan" else ""
-    time_html  = f'{date_val}<br><span style="color:#cbd5e1">{time_val}</span>' if time_val.strip() else date_val
 
-    st.markdown(f"""
-    <div class="smart-card {cls}">
-        <div class="card-circle">{amount_str}</div>
-        <div class="card-main">
-            <div class="c-title">{clean_desc}</div>
-            <div>{uid_badge}<span class="card-direction {dir_cls}">{dir_lbl}</span></div>
-            {after_html}
-        </div>
-        <div class="card-side">
-            <span class="badge {badge_cls}">{badge_txt}</span>
-            <div class="c-date">{time_html}</div>
-            {phone_html}
-        </div>
-    </div>""", unsafe_allow_html=True)
+def render_chart(fig_json: str):
+    st.plotly_chart(json.loads(fig_json), use_container_width=True)
+
+
+# ============================
+# FIX #8: כרטיסייה חכמה
+# ============================
+_UID_IN_PARENS_RE = re.compile(r"\(([^)]+)\)")
+_PARENS_RE        = re.compile(r"\s*\([^)]+\)")
+_ENTITY_RE        = r"&(?:#\d+|#x[0-9a-fA-F]+|\w+);"
+_MARK_HTML        = r'<mark style="background:#fef9c3;padding:0 2px;border-radius:3px">\1</mark>'
+# סוג כרטיס → (מחלקת כרטיס, מחלקת תג, טקסט תג, מחלקת כיוון, תווית כיוון)
+CARD_KINDS = {
+    "admin":  ("admin",  "badge-admin",  "פעולת מנהל", "dir-admin",  "🛡️ פעולת מנהל"),
+    "failed": ("failed", "badge-failed", "כושלת",      "dir-debit",  "❌ כושלת"),
+    "credit": ("credit", "badge-ok",     "מוצלחת",     "dir-credit", "⬆️ זכות"),
+    "debit":  ("debit",  "badge-ok",     "מוצלחת",     "dir-debit",  "⬇️ חובה"),
+}
+_CARD_TPL = ('<div class="smart-card {cls}"><div class="card-circle">{amount}</div>'
+             '<div class="card-main"><div class="c-title">{desc}</div>'
+             '<div>{uid_badge}<span class="card-direction {dir_cls}">{dir_lbl}</span></div>{after_html}</div>'
+             '<div class="card-side"><span class="badge {badge_cls}">{badge_txt}</span>'
+             '<div class="c-date">{time_html}</div>{phone_html}</div></div>')
+_UID_BADGE_TPL = ('<span style="direction:ltr;background:#f1f5f9;border-radius:6px;padding:1px 7px;font-size:0.7rem;'
+                  'color:#64748b;font-family:monospace;margin-right:6px">{}</span>')
+
+
+def _text_col(df: pd.DataFrame, *names: str, default: str = "") -> pd.Series:
+    """העמודה הראשונה מ-names שקיימת ב-df, כטקסט (ריק במקום NaN)."""
+    for n in names:
+        if n in df.columns: return df[n].astype(str).fillna("")
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def card_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """שדות התצוגה של כרטיסי הפעולות (CARD_FIELDS) – מעבר וקטורי אחד, טקסט כבר מוכן ל-HTML."""
+    status    = _text_col(df, "סטטוס", default="מוצלחת").str.strip()
+    direction = _text_col(df, "כיוון").str.strip()
+    kind = np.select([status.str.contains("מנהל", regex=False), status.str.contains("כושל|נכשל"),
+                      direction == "זכות"], ["admin", "failed", "credit"], default="debit")
+
+    amount = pd.to_numeric(_text_col(df, "סכום").str.strip(), errors="coerce").abs()
+    after  = pd.to_numeric(_text_col(df, "יתרה לאחר פעולה", "יתרה").str.strip(), errors="coerce")
+    # תיאור נקי: המספר שבסוגריים עובר לתג נפרד
+    raw_desc = _text_col(df, "תיאור", "הערה")
+    return pd.DataFrame({
+        "card_kind":   kind,
+        "card_desc":   _escape_col(raw_desc.str.replace(_PARENS_RE, "", regex=True).str.strip()),
+        "card_uid":    _escape_col(raw_desc.str.extract(_UID_IN_PARENS_RE, expand=False).fillna("")),
+        "card_amount": ("₪" + amount.map("{:,.0f}".format)).where(amount.notna(), "₪-"),
+        "card_after":  ("₪" + after.map("{:,.2f}".format)).where(after.notna(), ""),
+        "card_date":   _escape_col(_text_col(df, "תאריך")),
+        "card_time":   _escape_col(_text_col(df, "שעה")),
+        "card_phone":  _escape_col(_text_col(df, "טלפון", "מבצע")),
+    }, index=df.index)
+
+
+def cards_html(df: pd.DataFrame, highlight: str = "") -> list:
+    """HTML של כרטיס לכל שורה ב-df, בסדר השורות."""
+    if df.empty: return []
+    # טבלאות מ-get_user_actions כבר מכילות את עמודות התצוגה; אחרות מחושבות כאן
+    f = df if set(CARD_FIELDS).issubset(df.columns) else card_fields(df)
+    desc = f["card_desc"]
+    if highlight.strip():
+        # התיאור כבר מוברח – ישויות HTML (&amp; וכו') נבלעות בשלמותן ולא מסומנות מבפנים
+        pat  = re.compile(f"({re.escape(html.escape(highlight.strip()))})|{_ENTITY_RE}", re.IGNORECASE)
+        desc = desc.str.replace(pat, lambda m: m.expand(_MARK_HTML) if m.group(1) else m.group(0), regex=True)
+    cards = []
+    for kind, d, uid, amount, after, date, tm, phone in zip(
+            f["card_kind"], desc, f["card_uid"], f["card_amount"], f["card_after"],
+            f["card_date"], f["card_time"], f["card_phone"]):
+        cls, badge_cls, badge_txt, dir_cls, dir_lbl = CARD_KINDS[kind]
+        cards.append(_CARD_TPL.format(
+            cls=cls, amount=amount, desc=d, dir_cls=dir_cls, dir_lbl=dir_lbl,
+            badge_cls=badge_cls, badge_txt=badge_txt,
+            uid_badge=_UID_BADGE_TPL.format(uid) if uid else "",
+            after_html=(f'<div class="c-sub">יתרה לאחר: <span style="direction:ltr;display:inline-block">{after}</span></div>'
+                        if after else ""),
+            time_html=f'{date}<br><span style="color:#cbd5e1">{tm}</span>' if tm.strip() else date,
+            phone_html=(f'<div class="c-phone"><span style="direction:ltr;display:inline-block">{phone}</span></div>'
+                        if phone.strip() and phone != "nan" else "")))
+    return cards
+
+
+def render_cards(df: pd.DataFrame, highlight: str = ""):
+    """כל הכרטיסים של df באלמנט st.markdown אחד."""
+    if not df.empty: st.markdown("".join(cards_html(df, highlight)), unsafe_allow_html=True)
+
+
+VIRTUAL_LIST_MIN_ROWS = 200   # מעל זה – רשימה וירטואלית במקום דפדוף של 20 כרטיסים
+VIRTUAL_WINDOW_ROWS   = 300   # שורות בכל חלון שנשלח לדפדפן (נשלח מחדש בכל rerun); מעבר לזה – דפדוף בין חלונות
+VIRTUAL_ROW_PX        = 104   # גובה קבוע לשורה – מאפשר לחשב את החלון הגלוי בלי למדוד את ה-DOM
+VIRTUAL_LIST_HEIGHT   = 640
+_VLIST_TPL = """<html dir="rtl"><head><meta charset="UTF-8"><style>
+@import url('https://fonts.googleapis.com/css2?family=Heebo:wght@400;600;700;800&display=swap');
+body { margin: 0; font-family: 'Heebo', 'Segoe UI', Arial, sans-serif; direction: rtl; }
+#vl { height: __HEIGHT__px; overflow-y: auto; position: relative; }
+#vl-win { position: absolute; top: 0; left: 0; right: 0; padding: 0 4px; }
+.vl-row { height: __ROW__px; box-sizing: border-box; padding-top: 4px; overflow: hidden; }
+.vl-row .smart-card { margin-bottom: 0; height: calc(100% - 10px); box-sizing: border-box; }
+__CSS__
+</style></head><body>
+<div id="vl"><div style="height:__TOTAL__px"></div><div id="vl-win"></div></div>
+<script>
+const cards = __CARDS__, ROW = __ROW__, OVERSCAN = 8;
+const box = document.getElementById("vl"), win = document.getElementById("vl-win");
+let first = -1, queued = false;
+function draw() {
+  queued = false;
+  const f = Math.max(0, Math.floor(box.scrollTop / ROW) - OVERSCAN);
+  if (f === first) return;
+  first = f;
+  const last = Math.min(cards.length, f + Math.ceil(box.clientHeight / ROW) + 2 * OVERSCAN);
+  win.style.transform = "translateY(" + (f * ROW) + "px)";
+  win.innerHTML = cards.slice(f, last).map(c => '<div class="vl-row">' + c + '</div>').join("");
+}
+box.addEventListener("scroll", () => { if (!queued) { queued = true; requestAnimationFrame(draw); } }, {passive: true});
+draw();
+</script></body></html>"""
+
+
+def virtual_list_html(cards: list) -> str:
+    """רשימה וירטואלית: כל הכרטיסים נשלחים כ-JSON, אבל ב-DOM יש רק את החלון הגלוי (+ שוליים).
+
+    הגלילה מתבצעת כולה בדפדפן – בלי rerun של הסקריפט.
+    """
+    data = json.dumps(cards, ensure_ascii=False).replace("</", "<\\/")
+    return (_VLIST_TPL.replace("__CSS__", CARD_CSS).replace("__HEIGHT__", str(VIRTUAL_LIST_HEIGHT))
+            .replace("__ROW__", str(VIRTUAL_ROW_PX)).replace("__TOTAL__", str(len(cards) * VIRTUAL_ROW_PX))
+            .replace("__CARDS__", data))
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_virtual_list(scope: str, version: str, fkey: str, window: int, _df: pd.DataFrame, _rows: np.ndarray,
+                     _highlight: str = "") -> str:
+    """HTML של חלון אחד ברשימה הווירטואלית (נשמר לכל scope / גרסה / סינון / חלון) – לא בתוך session_state."""
+    return virtual_list_html(cards_html(_df.iloc[_rows], _highlight))
 
 
 # ============================
@@ -985,6 +2024,23 @@ def render_login_page():
         st.caption("אין הרשמה עצמאית. לפרטים חייג למערכת הטלפונית.")
 
 
+def _pwd_digest(pwd) -> bytes:
+    return hashlib.sha256(str(pwd).encode("utf-8")).digest()
+
+
+@st.cache_resource(max_entries=2)
+def get_login_index(version: str, _df_users: pd.DataFrame) -> dict:
+    """uid → (תקציר סיסמה, רשומת משתמש). נבנה פעם אחת לכל גרסת נתונים;
+    התחברות היא שליפה ממילון, בלי לסרוק או לשנות את טבלת המשתמשים המשותפת."""
+    index = {}
+    for rec in _df_users.drop(columns=DERIVED_COLS, errors="ignore").to_dict("records"):
+        index.setdefault(rec["מספר משתמש"], (_pwd_digest(rec.get("סיסמה", "")), rec))
+    return index
+
+
+_NO_USER_DIGEST = _pwd_digest(os.urandom(16).hex())  # השוואת דמה למשתמש לא קיים – זמן תגובה אחיד
+
+
 def _do_login(uid: str, pwd: str):
     """Login with rate limiting, digit validation, unified error message."""
     TIMEOUT_SECS = 15 * 60  # 15 min
@@ -1005,13 +2061,18 @@ def _do_login(uid: str, pwd: str):
     if not pwd.strip(): st.error("⚠️ נא להזין סיסמה"); return
     try:
         with st.spinner("מתחבר..."):
-            df_users, _, admin_ids = get_all_data()
-        df_users["מספר משתמש"] = df_users["מספר משתמש"].astype(str).str.strip()
-        df_users["סיסמה"]       = df_users["סיסמה"].astype(str).str.strip()
+            data = get_data_snapshot()
+            if data.get("users_from_disk"):
+                # הסיסמאות לא נשמרות בדיסק – ממתינים לרענון המשתמשים (שכבר רץ מאז הטעינה מהדיסק)
+                _revalidate_in_background(_get_data_store(), ("users",))
+                wait_for_refresh()
+                data = get_data_snapshot()
+                if data.get("users_from_disk"): raise RuntimeError("users not loaded yet")
         uid_c, pwd_c = uid.strip(), pwd.strip()
-        user_row = df_users[df_users["מספר משתמש"] == uid_c]
+        digest, user_rec = get_login_index(data["version"], data["users"]).get(uid_c, (_NO_USER_DIGEST, None))
+        pwd_ok = hmac.compare_digest(digest, _pwd_digest(pwd_c))
         # Unified error — don't reveal which field is wrong
-        if user_row.empty or user_row.iloc[0]["סיסמה"] != pwd_c:
+        if user_rec is None or not pwd_ok:
             attempts += 1
             st.session_state._login_attempts = attempts
             if attempts >= MAX_ATTEMPTS:
@@ -1026,8 +2087,8 @@ def _do_login(uid: str, pwd: str):
         st.session_state._login_attempts = 0
         st.session_state._lockout_until  = 0
         st.session_state.authenticated = True
-        st.session_state.user     = user_row.iloc[0].to_dict()
-        st.session_state.is_admin = uid_c in [str(x).strip() for x in admin_ids]
+        st.session_state.user     = dict(user_rec)
+        st.session_state.is_admin = uid_c in data["admins"]
         st.session_state.page     = "app"
         st.session_state._last_activity = datetime.now().timestamp()
         st.rerun()
@@ -1038,22 +2099,20 @@ def _do_login(uid: str, pwd: str):
 # ============================
 # Tab 1 – דשבורד
 # ============================
-def render_dashboard(u, is_admin, df_users, df_actions):
+def render_dashboard(u, is_admin, df_users, df_actions, ver, kpi):
     uid        = str(u.get("מספר משתמש",""))
-    balance    = get_user_balance(df_users, uid)
-    sync_time  = st.session_state.get("_last_sync", datetime.now().strftime("%H:%M:%S"))
-    my_act     = process_user_actions(df_actions, uid)
+    aggs       = get_user_aggregates(ver, df_users, df_actions)
+    summary    = user_summary(aggs, uid, month_start())
+    balance    = summary["יתרה"]
+    sync_time  = st.session_state.get("_last_sync", "")
+    my_act     = get_user_actions(ver, uid, df_actions)
 
     # פעולה אחרונה לתצוגה בברכה
     last_act_html = ""
-    if not my_act.empty:
-        try:
-            lr = my_act.iloc[-1]
-            la_icon = "📥" if str(lr.get("כיוון","")) == "זכות" else "📤"
-            la_amt  = f"₪{abs(float(lr.get('סכום',0))):,.0f}"
-            la_date = str(lr.get("תאריך",""))
-            last_act_html = f'<div class="greeting-last">{la_icon} פעולה אחרונה: <b>{la_amt}</b> · {la_date}</div>'
-        except: pass
+    if summary["פעולות"]:
+        la_icon = "📥" if summary["אחרונה_כיוון"] == "זכות" else "📤"
+        last_act_html = (f'<div class="greeting-last">{la_icon} פעולה אחרונה: <b>₪{summary["אחרונה_סכום"]:,.0f}</b>'
+                         f' · {summary["אחרונה_תאריך"]}</div>')
 
     admin_badge = "<span style='background:rgba(255,255,255,0.15);border-radius:8px;padding:3px 10px;font-size:0.75rem;margin-right:8px'>מנהל מערכת</span>" if is_admin else ""
     gr1, gr2 = st.columns([5, 1])
@@ -1062,7 +2121,7 @@ def render_dashboard(u, is_admin, df_users, df_actions):
         <div class="greeting-bar">
             <div>
                 <div class="greeting-name">שלום, {u.get('שם משתמש','')} 👋 {admin_badge}</div>
-                <div class="greeting-uid">מספר משתמש: {uid} · עודכן בשעה {sync_time}</div>
+                <div class="greeting-uid">מספר משתמש: {uid} · נתונים מהשעה {sync_time} · גרסה {ver[:6]}</div>
                 {last_act_html}
             </div>
             <div class="greeting-badge">💰 מערכת פיננסית</div>
@@ -1070,20 +2129,18 @@ def render_dashboard(u, is_admin, df_users, df_actions):
     with gr2:
         st.markdown("<div style='height:10px'></div>", unsafe_allow_html=True)
         if st.button("🔄 רענן", key="dash_refresh", use_container_width=True, help="טען מחדש נתונים עדכניים מ-Sheets"):
-            st.cache_data.clear()
-            st.rerun()
-
-    # FIX #4 – חישוב מחזור נכון
-    try:    total_volume = pd.to_numeric(df_actions["סכום"], errors="coerce").sum()
-    except: total_volume = 0
-
-    # חישוב הכנסות/הוצאות אישיות
-    if not my_act.empty and "סכום נטו" in my_act.columns:
-        net_vals = pd.to_numeric(my_act["סכום נטו"], errors="coerce").fillna(0)
-        personal_income = net_vals[net_vals > 0].sum()
-        personal_expense = net_vals[net_vals < 0].abs().sum()
-    else:
-        personal_income = personal_expense = 0.0
+            wait = request_refresh(uid)
+            if wait:
+                st.toast(f"⏳ הנתונים רועננו זה עתה – אפשר לרענן שוב בעוד {wait} שניות")
+            else:
+                with st.spinner("🔄 מרענן נתונים..."):
+                    wait_for_refresh()
+                st.rerun()
+
+    # FIX #4 – חישוב מחזור נכון; כל הסכומים מהסיכומים המחושבים מראש / מצבר המדדים
+    system           = kpi_summary(kpi) if is_admin else None
+    personal_income  = summary["הכנסות"]
+    personal_expense = summary["הוצאות"]
 
     c1,c2,c3 = st.columns(3)
     with c1:
@@ -1098,22 +2155,22 @@ def render_dashboard(u, is_admin, df_users, df_actions):
             st.markdown(f"""<div class="mc-wrap mc-green">
                 <div class="mc-icon">🔄</div>
                 <div class="mc-label">מחזור כללי במערכת</div>
-                <div class="mc-value">₪{total_volume:,.0f}</div>
-                <div class="mc-sub">סך כל הפעולות</div>
+                <div class="mc-value">₪{system["מחזור"]:,.0f}</div>
+                <div class="mc-sub">סך כל הפעולות · החודש ₪{system["מחזור_החודש"]:,.0f}</div>
             </div>""", unsafe_allow_html=True)
         else:
             st.markdown(f"""<div class="mc-wrap mc-green">
                 <div class="mc-icon">📥</div>
                 <div class="mc-label">סך הכנסות</div>
                 <div class="mc-value">₪{personal_income:,.0f}</div>
-                <div class="mc-sub">זכויות שהתקבלו</div>
+                <div class="mc-sub">זכויות שהתקבלו · החודש ₪{summary["הכנסות_חודש"]:,.0f}</div>
             </div>""", unsafe_allow_html=True)
     with c3:
         if is_admin:
             st.markdown(f"""<div class="mc-wrap mc-purple">
                 <div class="mc-icon">📋</div>
                 <div class="mc-label">סך פעולות מערכת</div>
-                <div class="mc-value">{len(df_actions)}</div>
+                <div class="mc-value">{system["פעולות"]}</div>
                 <div class="mc-sub">כלל הפעולות</div>
             </div>""", unsafe_allow_html=True)
         else:
@@ -1121,7 +2178,7 @@ def render_dashboard(u, is_admin, df_users, df_actions):
                 <div class="mc-icon">📤</div>
                 <div class="mc-label">סך הוצאות</div>
                 <div class="mc-value">₪{personal_expense:,.0f}</div>
-                <div class="mc-sub">חובות ששולמו</div>
+                <div class="mc-sub">חובות ששולמו · החודש ₪{summary["הוצאות_חודש"]:,.0f}</div>
             </div>""", unsafe_allow_html=True)
 
     st.markdown("")
@@ -1132,22 +2189,13 @@ def render_dashboard(u, is_admin, df_users, df_actions):
         st.markdown('<div class="section-title">📊 גרף פעילות</div>', unsafe_allow_html=True)
         if not my_act.empty:
             view = st.radio("תקופה", ["החודש הנוכחי","כל הפעולות"], horizontal=True, key="dash_view")
-            df_c = my_act.copy()
-            if view == "החודש הנוכחי" and "תאריך" in df_c.columns:
-                df_c = df_c[df_c["תאריך"].astype(str).str.startswith(datetime.now().strftime("%Y-%m"))]
-            if not df_c.empty and "תאריך" in df_c.columns:
-                try:
-                    df_c["סכום נטו"] = pd.to_numeric(df_c["סכום נטו"], errors="coerce").fillna(0)
-                    df_c["צבע"] = df_c["סכום נטו"].apply(lambda x: "הכנסה" if x>=0 else "הוצאה")
-                    fig = px.bar(df_c.tail(20), x="תאריך", y="סכום נטו", color="צבע",
-                                 color_discrete_map={"הכנסה":"#22c55e","הוצאה":"#ef4444"})
-                    style_fig(fig, height=280)
-                    fig.update_layout(xaxis_title="תאריך", yaxis_title="₪")
-                    st.plotly_chart(fig, use_container_width=True)
-                except Exception:
-                    render_empty_state("📊", "אין מספיק נתונים לגרף")
-            else:
-                render_empty_state("📅", "אין פעולות בתקופה זו", "נסה לבחור ‘כל הפעולות’")
+            period = month_range() if view == "החודש הנוכחי" else None
+            try:
+                fig_json = chart_json(uid, "bar", view, ver, my_act, period)
+                if fig_json: render_chart(fig_json)
+                else: render_empty_state("📅", "אין פעולות בתקופה זו", "נסה לבחור ‘כל הפעולות’")
+            except Exception:
+                render_empty_state("📊", "אין מספיק נתונים לגרף")
         else:
             render_empty_state("💳", "עדיין אין פעולות", "הפעולות שלך יופיעו כאן לאחר הביצוע הראשון")
 
@@ -1155,8 +2203,7 @@ def render_dashboard(u, is_admin, df_users, df_actions):
         st.markdown('<div class="section-title">⚡ 5 פעולות אחרונות</div>', unsafe_allow_html=True)
         feed = df_actions if is_admin else my_act
         if not feed.empty:
-            for _, row in feed.tail(5).iloc[::-1].iterrows():
-                render_smart_card(row)
+            render_cards(feed.tail(5).iloc[::-1])
         else:
             render_empty_state("📥", "אין פעולות להצגה")
 
@@ -1164,59 +2211,31 @@ def render_dashboard(u, is_admin, df_users, df_actions):
 # ============================
 # Tab 2 – עובר ושב  FIX #5
 # ============================
-def render_history(u, is_admin, df_users, df_actions):
+def render_history(u, is_admin, df_users, df_actions, ver):
     uid = str(u.get("מספר משתמש",""))
 
-    if is_admin:
-        my_act = df_actions.copy()
-        try:
-            my_act["כיוון"]    = "חובה"
-            my_act["סכום נטו"] = pd.to_numeric(my_act["סכום"], errors="coerce").fillna(0)
-            my_act["תיאור"]    = my_act.apply(lambda r: f"העברה מ-{r.get('שם מקור','').strip()} אל {r.get('שם יעד','').strip()}", axis=1)
-        except Exception: pass
-    else:
-        my_act = process_user_actions(df_actions, uid)
+    my_act = get_admin_ledger(ver, df_actions) if is_admin else get_user_actions(ver, uid, df_actions)
 
     if my_act.empty:
         render_empty_state("📋", "אין פעולות להצגה", "כאשר יבוצעו פעולות הן יופיעו כאן")
         return
 
-    for col in ["תאריך","שעה","סכום","סטטוס","כיוון","תיאור","שם מקור","שם יעד"]:
-        if col not in my_act.columns: my_act[col] = ""
-
-    my_act["סכום_num"] = pd.to_numeric(my_act["סכום"], errors="coerce").fillna(0)
-
     # גרפים
     st.markdown('<div class="section-title">📈 אנליטיקס</div>', unsafe_allow_html=True)
     tab_pie, tab_line = st.tabs(["🥧 לאן הכסף עבר?","📉 מגמת יתרה"])
 
+    scope = "*" if is_admin else uid
     with tab_pie:
         try:
-            debits = my_act[my_act["כיוון"]=="חובה"].copy()
-            if not debits.empty and "שם יעד" in debits.columns:
-                pie_df = debits.groupby("שם יעד")["סכום_num"].sum().reset_index()
-                pie_df.columns = ["שם","סכום"]
-                pie_df = pie_df[pie_df["שם"].str.strip()!=""]
-                fig_pie = px.pie(pie_df, names="שם", values="סכום",
-                                 title="פילוח הוצאות לפי יעד", hole=0.4,
-                                 color_discrete_sequence=px.colors.sequential.Blues_r)
-                style_fig(fig_pie, height=300)
-                st.plotly_chart(fig_pie, use_container_width=True)
+            fig_json = chart_json(scope, "pie", "", ver, my_act)
+            if fig_json: render_chart(fig_json)
             else: render_empty_state("🦷", "אין נתוני הוצאות", "כאשר תבצע תשלומים, הגרף יופיע כאן")
         except Exception as e: st.warning(f"שגיאה: {e}")
 
     with tab_line:
         try:
-            if "תאריך" in my_act.columns:
-                line_df = my_act[["תאריך","סכום נטו"]].copy()
-                line_df["סכום נטו"] = pd.to_numeric(line_df["סכום נטו"], errors="coerce").fillna(0)
-                line_df = line_df.sort_values("תאריך")
-                line_df["יתרה מצטברת"] = line_df["סכום נטו"].cumsum()
-                fig_l = px.line(line_df, x="תאריך", y="יתרה מצטברת",
-                                markers=True, color_discrete_sequence=["#0f3460"])
-                style_fig(fig_l, height=300)
-                fig_l.update_layout(yaxis_title="₪")
-                st.plotly_chart(fig_l, use_container_width=True)
+            fig_json = chart_json(scope, "line", "", ver, my_act)
+            if fig_json: render_chart(fig_json)
             else: render_empty_state("📉", "אין מספיק נתונים", "נדרשות לפחות 2 פעולות עם תאריכים")
         except Exception: render_empty_state("📉", "לא היה ניתן לטעון את הגרף")
 
@@ -1244,28 +2263,24 @@ def render_history(u, is_admin, df_users, df_actions):
     with fc4: min_amt = st.number_input("סכום מינימלי ₪", value=0.0, step=10.0, key="hist_min")
     with fc5: max_amt = st.number_input("סכום מקסימלי ₪ (ביטול = אין גבול)", value=0.0, step=100.0, key="hist_max", help="0 = ללא גבול")
 
-    # החלת סינונים
-    filtered = my_act.copy()
-    if search_text:
-        filtered = filtered[filtered.apply(lambda r: search_text.lower() in " ".join(r.astype(str).values).lower(), axis=1)]
-
-    if date_filter == "החודש הנוכחי":
-        filtered = filtered[filtered["תאריך"].astype(str).str.startswith(datetime.now().strftime("%Y-%m"))]
-    elif date_filter == "חודש קודם":
-        lm = (datetime.now().replace(day=1) - pd.Timedelta(days=1)).strftime("%Y-%m")
-        filtered = filtered[filtered["תאריך"].astype(str).str.startswith(lm)]
-    elif date_filter == "טווח מותאם" and date_from and date_to:
-        filtered = filtered[(filtered["תאריך"].astype(str)>=str(date_from)) & (filtered["תאריך"].astype(str)<=str(date_to))]
-
-    if status_filter and "הכל" not in status_filter:
-        conds = []
-        if "זכות"        in status_filter: conds.append(filtered["כיוון"]=="זכות")
-        if "חובה"        in status_filter: conds.append(filtered["כיוון"]=="חובה")
-        if "כושלות"      in status_filter: conds.append(filtered["סטטוס"].astype(str).str.contains("כושל|נכשל",na=False))
-        if "פעולות מנהל" in status_filter: conds.append(filtered["סטטוס"].astype(str).str.contains("מנהל",na=False))
-        if conds: filtered = filtered[functools.reduce(lambda a,b: a|b, conds)]
-
-    filtered = filtered[(filtered["סכום_num"].abs()>=min_amt) & (max_amt == 0.0 or filtered["סכום_num"].abs()<=max_amt)]
+    # החלת סינונים – מיקומי השורות נשמרים לכל (משתמש, גרסה, סינון); דפדוף לא מחשב אותם מחדש
+    period = {"החודש הנוכחי": month_range(), "חודש קודם": month_range(1)}.get(date_filter)
+    if date_filter == "טווח מותאם" and date_from and date_to:
+        period = (pd.Timestamp(date_from), pd.Timestamp(date_to) + pd.Timedelta(days=1))
+    filters_on = bool(search_text or period or (status_filter and "הכל" not in status_filter) or min_amt or max_amt)
+    mkey = (scope, ver, search_text, date_filter, str(period), tuple(status_filter), min_amt, max_amt)
+    memo = st.session_state.get("_hist_memo")
+    if not memo or memo["key"] != mkey:
+        rows = filter_history_rows(my_act, ver, scope, search_text, period, status_filter, min_amt, max_amt)
+        if not is_admin and not filters_on:
+            # בלי סינון – הסיכום כבר מחושב מראש לכל משתמש
+            summary = user_summary(get_user_aggregates(ver, df_users, df_actions), uid)
+            total_in, total_out = summary["הכנסות"], summary["הוצאות"]
+        else:
+            net = np.nan_to_num(my_act["סכום נטו"].to_numpy(dtype=float)[rows])
+            total_in, total_out = net.clip(min=0).sum(), (-net).clip(min=0).sum()
+        memo = st.session_state._hist_memo = {"key": mkey, "rows": rows, "sorted": {},
+                                              "total_in": total_in, "total_out": total_out}
     st.markdown('</div>', unsafe_allow_html=True)  # close filter-card
 
     # מיון
@@ -1277,28 +2292,19 @@ def render_history(u, is_admin, df_users, df_actions):
                     box-shadow:0 1px 6px rgba(0,0,0,0.05);margin-bottom:4px;height:42px;
                     display:flex;align-items:center">
             <span style="font-size:0.85rem;color:#475569;font-weight:600">
-                📋 נמצאו <span style="color:#0f3460;font-size:1rem">{len(filtered)}</span> פעולות
+                📋 נמצאו <span style="color:#0f3460;font-size:1rem">{len(memo["rows"])}</span> פעולות
             </span>
         </div>""", unsafe_allow_html=True)
     with res2:
         sort_opt = st.selectbox("מיון", sort_options, key="hist_sort", label_visibility="collapsed")
 
     # החלת מיון
-    if "תאריך ↑" in sort_opt:
-        filtered = filtered.sort_values("תאריך", ascending=True)
-    elif "תאריך ↓" in sort_opt:
-        filtered = filtered.sort_values("תאריך", ascending=False)
-    elif "סכום ↓" in sort_opt:
-        filtered = filtered.assign(_abs=filtered["סכום_num"].abs()).sort_values("_abs", ascending=False).drop(columns="_abs")
-    elif "סכום ↑" in sort_opt:
-        filtered = filtered.assign(_abs=filtered["סכום_num"].abs()).sort_values("_abs", ascending=True).drop(columns="_abs")
-    elif "זכויות" in sort_opt:
-        filtered = filtered.sort_values("כיוון", ascending=False) if "כיוון" in filtered.columns else filtered
-    elif "חובות" in sort_opt:
-        filtered = filtered.sort_values("כיוון", ascending=True) if "כיוון" in filtered.columns else filtered
+    rows = memo["sorted"].get(sort_opt)
+    if rows is None:
+        rows = memo["sorted"][sort_opt] = sort_history_rows(my_act, memo["rows"], sort_opt)
 
     # FIX #5 – reset page on filter/sort change
-    fkey = f"{search_text}|{date_filter}|{status_filter}|{min_amt}|{max_amt}|{sort_opt}"
+    fkey = f"{search_text}|{date_filter}|{period}|{status_filter}|{min_amt}|{max_amt}|{sort_opt}"
     if st.session_state.get("_hist_fkey") != fkey:
         st.session_state._hist_fkey = fkey
         st.session_state.hist_page  = 0
@@ -1307,65 +2313,21 @@ def render_history(u, is_admin, df_users, df_actions):
     ex1,ex2,_ = st.columns([1,1,4])
     with ex1:
         try:
-            buf = BytesIO()
-            exp_df = filtered.drop(columns=["סכום_num"],errors="ignore")
-            user_name = u.get("שם משתמש", "") if 'u' in dir() else ""
-            with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-                # Write data starting from row 4 (leave space for header)
-                exp_df.to_excel(writer, index=False, startrow=3, sheet_name="פעולות")
-                ws = writer.sheets["פעולות"]
-                # Header rows
-                ws["A1"] = "💰 שיעבודא פון – דוח פעולות"
-                ws["A2"] = f"משתמש: {user_name}  |  תאריך הפקה: {datetime.now().strftime('%d/%m/%Y %H:%M')}  |  סך פעולות: {len(exp_df)}"
-                # Style header
-                from openpyxl.styles import Font, PatternFill, Alignment
-                ws["A1"].font = Font(name="Arial", size=14, bold=True, color="1F3460")
-                ws["A2"].font = Font(name="Arial", size=10, color="475569")
-                ws["A1"].alignment = Alignment(horizontal="right")
-                ws["A2"].alignment = Alignment(horizontal="right")
-                # Column headers style (row 4)
-                hdr_fill = PatternFill("solid", fgColor="0F3460")
-                hdr_font = Font(name="Arial", bold=True, color="FFFFFF")
-                for cell in ws[4]:
-                    cell.fill = hdr_fill
-                    cell.font = hdr_font
-                    cell.alignment = Alignment(horizontal="right")
-                # Auto-width columns
-                for col in ws.columns:
-                    max_len = max((len(str(c.value or "")) for c in col), default=8)
-                    ws.column_dimensions[col[0].column_letter].width = min(max_len + 4, 40)
-            st.download_button("📥 ייצוא Excel", data=buf.getvalue(), file_name="shiabudefon.xlsx",
+            import openpyxl  # noqa: F401 – הקובץ עצמו נבנה רק בלחיצה
+            user_name = u.get("שם משתמש", "")
+            st.download_button("📥 ייצוא Excel", file_name="shiabudefon.xlsx",
+                               data=lambda: build_history_xlsx(scope, ver, fkey, user_name, my_act, rows),
                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        except Exception: st.warning("התקן openpyxl")
+        except ImportError: st.warning("התקן openpyxl")
     with ex2:
-        try:
-            exp = filtered.drop(columns=["סכום_num"],errors="ignore")
-            trs = "".join(
-                f"<tr style='background:{'#fff5f5' if r.get('כיוון')=='חובה' else '#f0fff4'}'>" +
-                "".join(f"<td>{v}</td>" for v in r.values) + "</tr>"
-                for _,r in exp.iterrows()
-            )
-            ths = "".join(f"<th>{c}</th>" for c in exp.columns)
-            html = (f'<!DOCTYPE html><html dir="rtl"><head><meta charset="UTF-8">'
-                    f'<style>body{{font-family:Arial;direction:rtl;padding:24px}}'
-                    f'h2{{color:#0f3460}}table{{border-collapse:collapse;width:100%;font-size:12px}}'
-                    f'th{{background:#0f3460;color:white;padding:8px;border:1px solid #ccc}}'
-                    f'td{{padding:6px;border:1px solid #ddd}}'
-                    f'@media print{{@page{{size:A4 landscape;margin:1cm}}button{{display:none}}}}'
-                    f'</style></head><body>'
-                    f'<h2>שיעבודא פון – דו"ח פעולות</h2>'
-                    f'<p>תאריך הפקה: {datetime.now().strftime("%d/%m/%Y %H:%M")} | פעולות: {len(filtered)}</p>'
-                    f'<table><thead><tr>{ths}</tr></thead><tbody>{trs}</tbody></table>'
-                    f'<br><button onclick="window.print()">🖨️ הדפס / שמור כ-PDF</button>'
-                    f'</body></html>')
-            st.download_button("📄 PDF (הדפסה)", data=html.encode("utf-8"),
-                               file_name="shiabudefon_report.html", mime="text/html")
-        except Exception: pass
-
-    # דפדוף
+        st.download_button("📄 PDF (הדפסה)", file_name="shiabudefon_report.html", mime="text/html",
+                           data=lambda: build_history_html(scope, ver, fkey, my_act, rows))
+
+    # דפדוף – עד VIRTUAL_LIST_MIN_ROWS שורות: עמודים של 20 כרטיסים; מעל זה: רשימה וירטואלית בחלונות גדולים
     st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
-    PAGE_SIZE   = 20
-    total_pages = max(1,(len(filtered)+PAGE_SIZE-1)//PAGE_SIZE)
+    virtual     = len(rows) > VIRTUAL_LIST_MIN_ROWS
+    PAGE_SIZE   = VIRTUAL_WINDOW_ROWS if virtual else 20
+    total_pages = max(1,(len(rows)+PAGE_SIZE-1)//PAGE_SIZE)
     if "hist_page" not in st.session_state: st.session_state.hist_page = 0
     st.session_state.hist_page = min(st.session_state.hist_page, total_pages-1)
 
@@ -1391,51 +2353,47 @@ def render_history(u, is_admin, df_users, df_actions):
             if st.button("הבא ▶", key="pg_next", use_container_width=True):
                 st.session_state.hist_page+=1; st.rerun()
 
-    start   = st.session_state.hist_page * PAGE_SIZE
-    page_df = filtered.iloc[::-1].reset_index(drop=True).iloc[start:start+PAGE_SIZE]
+    # העמוד = חיתוך של מערך המיקומים (view), נשלפות רק השורות של העמוד
+    start     = st.session_state.hist_page * PAGE_SIZE
+    page_rows = rows[start:start+PAGE_SIZE]
 
-    if filtered.empty:
+    if not len(rows):
         render_empty_state("🔍", "לא נמצאו פעולות התואמות את החיפוש שלך", "נסה לשנות את קריתריוני הסינון"); return
-    if not filtered.empty and "סכום_num" in filtered.columns:
-        f_credits  = filtered[filtered.get("כיוון", pd.Series()) == "זכות"]["סכום_num"].abs().sum() if "כיוון" in filtered.columns else 0
-        f_debits   = filtered[filtered.get("כיוון", pd.Series()) == "חובה"]["סכום_num"].abs().sum() if "כיוון" in filtered.columns else 0
-        f_credits_v = filtered[filtered["סכום_num"] > 0]["סכום_num"].sum()
-        f_debits_v  = filtered[filtered["סכום_num"] < 0]["סכום_num"].abs().sum()
-        total_in  = f_credits_v or f_credits
-        total_out = f_debits_v  or f_debits
-        if total_in or total_out:
-            st.markdown(f"""
-            <div style="display:flex;gap:12px;margin-bottom:14px;flex-wrap:wrap">
-                <div style="flex:1;min-width:140px;background:#f0fdf4;border-radius:12px;
-                            padding:12px 16px;border:1px solid #dcfce7;text-align:center">
-                    <div style="font-size:0.75rem;color:#16a34a;font-weight:600;margin-bottom:3px">📥 סך הכנסות בסינון</div>
-                    <div style="font-size:1.15rem;font-weight:800;color:#14532d;direction:ltr">₪{total_in:,.2f}</div>
-                </div>
-                <div style="flex:1;min-width:140px;background:#fff5f5;border-radius:12px;
-                            padding:12px 16px;border:1px solid #fee2e2;text-align:center">
-                    <div style="font-size:0.75rem;color:#dc2626;font-weight:600;margin-bottom:3px">📤 סך הוצאות בסינון</div>
-                    <div style="font-size:1.15rem;font-weight:800;color:#7f1d1d;direction:ltr">₪{total_out:,.2f}</div>
-                </div>
-                <div style="flex:1;min-width:140px;background:#eff6ff;border-radius:12px;
-                            padding:12px 16px;border:1px solid #dbeafe;text-align:center">
-                    <div style="font-size:0.75rem;color:#2563eb;font-weight:600;margin-bottom:3px">📊 נטו</div>
-                    <div style="font-size:1.15rem;font-weight:800;color:#1e3a8a;direction:ltr">₪{total_in-total_out:,.2f}</div>
-                </div>
-            </div>""", unsafe_allow_html=True)
+    total_in, total_out = memo["total_in"], memo["total_out"]
+    if total_in or total_out:
+        st.markdown(f"""
+        <div style="display:flex;gap:12px;margin-bottom:14px;flex-wrap:wrap">
+            <div style="flex:1;min-width:140px;background:#f0fdf4;border-radius:12px;
+                        padding:12px 16px;border:1px solid #dcfce7;text-align:center">
+                <div style="font-size:0.75rem;color:#16a34a;font-weight:600;margin-bottom:3px">📥 סך הכנסות בסינון</div>
+                <div style="font-size:1.15rem;font-weight:800;color:#14532d;direction:ltr">₪{total_in:,.2f}</div>
+            </div>
+            <div style="flex:1;min-width:140px;background:#fff5f5;border-radius:12px;
+                        padding:12px 16px;border:1px solid #fee2e2;text-align:center">
+                <div style="font-size:0.75rem;color:#dc2626;font-weight:600;margin-bottom:3px">📤 סך הוצאות בסינון</div>
+                <div style="font-size:1.15rem;font-weight:800;color:#7f1d1d;direction:ltr">₪{total_out:,.2f}</div>
+            </div>
+            <div style="flex:1;min-width:140px;background:#eff6ff;border-radius:12px;
+                        padding:12px 16px;border:1px solid #dbeafe;text-align:center">
+                <div style="font-size:0.75rem;color:#2563eb;font-weight:600;margin-bottom:3px">📊 נטו</div>
+                <div style="font-size:1.15rem;font-weight:800;color:#1e3a8a;direction:ltr">₪{total_in-total_out:,.2f}</div>
+            </div>
+        </div>""", unsafe_allow_html=True)
 
-    for _,row in page_df.iterrows():
-        render_smart_card(row, highlight=search_text)
+    if virtual:
+        # fkey כולל את החיפוש והמיון – rerun של אותו סינון / מיון / חלון לא בונה את ה-HTML מחדש
+        vlist = get_virtual_list(scope, ver, fkey, st.session_state.hist_page, my_act, page_rows, search_text)
+        components.html(vlist, height=VIRTUAL_LIST_HEIGHT + 10)
+    else:
+        render_cards(my_act.iloc[page_rows], highlight=search_text)
 
 
 # ============================
 # Tab 3 – פרטים אישיים
 # ============================
-def render_personal(u, df_users):
+def render_personal(u, df_users, ver):
     uid = str(u.get("מספר משתמש",""))
-    df  = df_users.copy()
-    df["מספר משתמש"] = df["מספר משתמש"].astype(str).str.strip()
-    row       = df[df["מספר משתמש"]==uid]
-    user_data = row.iloc[0].to_dict() if not row.empty else u
+    user_data = get_login_index(ver, df_users).get(uid, (None, None))[1] or u
 
     st.markdown('<div class="section-title">👤 החשבון שלי – פרטים מזהים</div>', unsafe_allow_html=True)
     raw_pwd = str(user_data.get("סיסמה", "—"))
@@ -1473,7 +2431,7 @@ def render_personal(u, df_users):
 # ============================
 # Tab 4 – צ'אט AI
 # ============================
-def render_chat_tab(u, is_admin, df_users, df_actions):
+def render_chat_tab(u, is_admin, df_users, df_actions, ver):
     uid = str(u.get("מספר משתמש",""))
     if "messages" not in st.session_state: st.session_state.messages = []
 
@@ -1504,11 +2462,12 @@ def render_chat_tab(u, is_admin, df_users, df_actions):
         with st.chat_message("assistant"):
             with st.spinner("חושב..."):
                 if is_admin:
-                    context = f"פעולות:\n{df_actions.to_csv()}\nמשתמשים (ללא סיסמאות):\n{df_users.drop(columns=['סיסמה'], errors='ignore').to_csv()}"
+                    context = f"פעולות:\n{df_actions.drop(columns=DERIVED_COLS, errors='ignore').to_csv()}\nמשתמשים (ללא סיסמאות):\n{df_users.drop(columns=[*SENSITIVE_COLS, *DERIVED_COLS], errors='ignore').to_csv()}"
                 else:
-                    my_act   = process_user_actions(df_actions, uid)
-                    curr_row = df_users[df_users["מספר משתמש"].astype(str)==uid].drop(columns=["סיסמה"], errors="ignore")
-                    context  = f"פרטים:\n{curr_row.to_csv()}\nפעולות:\n{my_act.drop(columns=['סכום_num'], errors='ignore').to_csv()}"
+                    my_act   = get_user_actions(ver, uid, df_actions)
+                    user_rec = get_login_index(ver, df_users).get(uid, (None, None))[1]
+                    curr_row = pd.DataFrame([user_rec] if user_rec else []).drop(columns=SENSITIVE_COLS, errors="ignore")
+                    context  = f"פרטים:\n{curr_row.to_csv()}\nפעולות:\n{my_act.drop(columns=DERIVED_COLS, errors='ignore').to_csv()}"
                 reply = "מצטער, לא הצלחתי לקבל תשובה."; tokens_info = ""
                 model_name = _get_gemini_model_name()
                 for key in get_api_keys():
@@ -1530,22 +2489,98 @@ def render_chat_tab(u, is_admin, df_users, df_actions):
 # ============================
 # Admin
 # ============================
-def render_admin(df_users, df_actions):
-    try:    total_vol = pd.to_numeric(df_actions["סכום"], errors="coerce").sum()
-    except: total_vol = 0
-    try:    avg_tx = total_vol / max(len(df_actions), 1)
-    except: avg_tx = 0
+ADMIN_PAGE_SIZES = [50, 100, 250, 500]
+# עמודת תצוגה → העמודה המחושבת שלפיה ממיינים (מספר / תאריך במקום טקסט)
+GRID_SORT_KEYS   = {"סכום": "סכום_num", "תאריך": "תאריך_dt", "שעה": "תאריך_dt", "יתרה": "יתרה_num"}
+
+
+@st.cache_resource(max_entries=16)
+def get_grid_order(version: str, table: str, col: str, ascending: bool, _df: pd.DataFrame) -> np.ndarray:
+    """מיקומי כל השורות של הטבלה ממוינים לפי col (ריקים בסוף) – נבנה פעם אחת לכל גרסה / עמודה / כיוון."""
+    key = GRID_SORT_KEYS.get(col, col)
+    s   = _df[key] if key in _df.columns else _df[col]
+    return s.reset_index(drop=True).sort_values(ascending=ascending, kind="stable", na_position="last").index.to_numpy()
+
+
+def render_grid(table: str, df: pd.DataFrame, version: str, cols: list, statuses=None):
+    """טבלת מנהל: חיפוש, סינון, מיון ודפדוף בשרת – לדפדפן נשלח רק חלון השורות המוצג, בלי עמודות רגישות."""
+    cols = [c for c in cols if c not in SENSITIVE_COLS]
+    g1, g2, g3, g4 = st.columns([3, 2, 1, 1])
+    with g1: search = st.text_input("🔎 חיפוש", "", key=f"{table}_grid_search")
+    with g2: sort_col = st.selectbox("מיון לפי", ["סדר הגיליון", *cols], key=f"{table}_grid_sort")
+    with g3: desc = st.toggle("מהסוף", value=True, key=f"{table}_grid_desc")
+    with g4: page_size = st.selectbox("שורות בעמוד", ADMIN_PAGE_SIZES, key=f"{table}_grid_size")
+    if statuses:
+        status_filter = st.multiselect("סטטוס", ["הכל", *statuses], default=["הכל"], key=f"{table}_grid_status")
+        rows = filter_history_rows(df, version, table, search.strip(), None, status_filter)
+    else:
+        rows = search_rows(get_search_index(version, table, df), search) if search.strip() else np.arange(len(df))
+    if sort_col != "סדר הגיליון":
+        order = get_grid_order(version, table, sort_col, not desc, df)
+        rows  = order if len(rows) == len(df) else order[np.isin(order, rows, assume_unique=True)]
+    elif desc:
+        rows = rows[::-1]
+
+    pages = max(1, -(-len(rows) // page_size))
+    pkey  = f"{table}_grid_page"
+    if st.session_state.get(pkey, 1) > pages: st.session_state[pkey] = pages
+    p1, p2 = st.columns([1, 3])
+    with p1: page = st.number_input(f"עמוד (מתוך {pages})", min_value=1, max_value=pages, step=1, key=pkey)
+    start = (page - 1) * page_size
+    window = rows[start:start + page_size]
+    with p2:
+        st.markdown(f'<div style="color:#64748b;font-size:0.8rem;padding-top:34px">'
+                    f'שורות {start + 1 if len(window) else 0}–{start + len(window)} מתוך {len(rows)} (סה״כ {len(df)})</div>',
+                    unsafe_allow_html=True)
+    view = df.iloc[window, [df.columns.get_loc(c) for c in cols]]
+    # category עם ערכים מטיפוסים שונים (מספר / טקסט) לא עובר ל-Arrow – החלון הקטן נשלח כערכים רגילים
+    view = view.astype({c: object for c, t in view.dtypes.items() if isinstance(t, pd.CategoricalDtype)})
+    st.dataframe(view, hide_index=True, use_container_width=True)
+
+
+@st.cache_resource(max_entries=2)
+def get_memory_report(version: str, _frames: dict) -> pd.DataFrame:
+    """גודל הטבלאות המשותפות בזיכרון (MB), ולצידו הגודל אילו עמודות ה-category נשמרו כטקסט רגיל."""
+    out = []
+    for name, df in _frames.items():
+        usage = df.memory_usage(deep=True, index=False)
+        plain = usage.copy()
+        for c in df.columns[[isinstance(t, pd.CategoricalDtype) for t in df.dtypes]]:
+            plain[c] = df[c].astype(df[c].cat.categories.dtype).memory_usage(deep=True, index=False)
+        out.append({"טבלה": name, "שורות": len(df), "עמודות": len(df.columns),
+                    "MB": usage.sum() / 2**20, "MB ללא category": plain.sum() / 2**20})
+    return pd.DataFrame(out)
+
+
+def process_rss_mb() -> float | None:
+    """הזיכרון שהתהליך תופס כרגע (RSS); None כשאין /proc (לא Linux)."""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except Exception: return None
+
+
+def render_admin(df_users, df_actions, ver, kpi):
+    system = kpi_summary(kpi)
 
     st.markdown('<div class="section-title">🛠️ לוח בקרה – מנהל מערכת</div>', unsafe_allow_html=True)
     c1,c2,c3,c4 = st.columns(4)
     with c1:
         st.markdown(f'<div class="mc-wrap mc-blue"><div class="mc-icon">👥</div><div class="mc-label">משתמשים רשומים</div><div class="mc-value">{len(df_users)}</div><div class="mc-sub">סך משתמשים</div></div>', unsafe_allow_html=True)
     with c2:
-        st.markdown(f'<div class="mc-wrap mc-green"><div class="mc-icon">📋</div><div class="mc-label">סך פעולות</div><div class="mc-value">{len(df_actions)}</div><div class="mc-sub">פעולות שבוצעו</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="mc-wrap mc-green"><div class="mc-icon">📋</div><div class="mc-label">סך פעולות</div><div class="mc-value">{system["פעולות"]}</div><div class="mc-sub">פעולות שבוצעו</div></div>', unsafe_allow_html=True)
     with c3:
-        st.markdown(f'<div class="mc-wrap mc-purple"><div class="mc-icon">💸</div><div class="mc-label">מחזור כללי</div><div class="mc-value">₪{total_vol:,.0f}</div><div class="mc-sub">סך כל העברות</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="mc-wrap mc-purple"><div class="mc-icon">💸</div><div class="mc-label">מחזור כללי</div><div class="mc-value">₪{system["מחזור"]:,.0f}</div><div class="mc-sub">סך כל העברות</div></div>', unsafe_allow_html=True)
     with c4:
-        st.markdown(f'<div class="mc-wrap" style="background:linear-gradient(135deg,#b45309,#d97706);box-shadow:0 6px 20px rgba(180,83,9,0.35)"><div class="mc-icon">📊</div><div class="mc-label">עסקה ממוצעת</div><div class="mc-value">₪{avg_tx:,.0f}</div><div class="mc-sub">לפעולה</div></div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="mc-wrap" style="background:linear-gradient(135deg,#b45309,#d97706);box-shadow:0 6px 20px rgba(180,83,9,0.35)"><div class="mc-icon">📊</div><div class="mc-label">עסקה ממוצעת</div><div class="mc-value">₪{system["ממוצע"]:,.0f}</div><div class="mc-sub">לפעולה</div></div>', unsafe_allow_html=True)
+    c5,c6,c7,c8 = st.columns(4)
+    with c5:
+        st.markdown(f'<div class="mc-wrap mc-blue"><div class="mc-icon">📅</div><div class="mc-label">מחזור היום</div><div class="mc-value">₪{system["מחזור_היום"]:,.0f}</div><div class="mc-sub">פעולות מהיום</div></div>', unsafe_allow_html=True)
+    with c6:
+        st.markdown(f'<div class="mc-wrap mc-green"><div class="mc-icon">🗓️</div><div class="mc-label">מחזור החודש</div><div class="mc-value">₪{system["מחזור_החודש"]:,.0f}</div><div class="mc-sub">מתחילת החודש</div></div>', unsafe_allow_html=True)
+    with c7:
+        st.markdown(f'<div class="mc-wrap mc-purple"><div class="mc-icon">🧑‍💼</div><div class="mc-label">משתמשים פעילים</div><div class="mc-value">{system["פעילים"]}</div><div class="mc-sub">ביצעו או קיבלו פעולה</div></div>', unsafe_allow_html=True)
+    with c8:
+        st.markdown(f'<div class="mc-wrap" style="background:linear-gradient(135deg,#b91c1c,#ef4444);box-shadow:0 6px 20px rgba(185,28,28,0.35)"><div class="mc-icon">⚠️</div><div class="mc-label">שיעור כשלונות</div><div class="mc-value">{system["כושלות_אחוז"]:.1f}%</div><div class="mc-sub">מכלל הפעולות</div></div>', unsafe_allow_html=True)
 
     st.markdown("")
     st.markdown("""
@@ -1554,13 +2589,30 @@ def render_admin(df_users, df_actions):
         box-shadow: 0 2px 12px rgba(0,0,0,0.06) !important; }
     </style>""", unsafe_allow_html=True)
 
-    at1,at2 = st.tabs(["📋 כל הפעולות","👥 משתמשים"])
+    at1,at2,at3,at4 = st.tabs(["📋 כל הפעולות","👥 משתמשים","⚖️ התאמת יתרות","🧠 זיכרון"])
     with at1:
-        st.markdown(f'<div style="color:#64748b;font-size:0.8rem;margin-bottom:8px">50 פעולות אחרונות מתוך {len(df_actions)}</div>', unsafe_allow_html=True)
-        st.dataframe(df_actions.tail(50).iloc[::-1], hide_index=True, use_container_width=True)
+        ledger = get_admin_ledger(ver, df_actions)
+        if ledger.empty: render_empty_state("📋", "אין פעולות להצגה")
+        else: render_grid("*", ledger, ver, [*(c for c in df_actions.columns if c not in DERIVED_COLS), "כיוון"],
+                          statuses=list(HIST_STATUS))
     with at2:
-        st.markdown(f'<div style="color:#64748b;font-size:0.8rem;margin-bottom:8px">{len(df_users)} משתמשים רשומים</div>', unsafe_allow_html=True)
-        st.dataframe(df_users, hide_index=True, use_container_width=True)
+        render_grid("users", df_users, ver, [c for c in df_users.columns if c not in DERIVED_COLS])
+    with at3:
+        recon = get_reconciliation(ver, df_users, kpi)
+        st.markdown(f'<div style="color:#64748b;font-size:0.8rem;margin-bottom:8px">היתרה השמורה מול סכום הפעולות (ללא כושלות) – '
+                    f'{recon.attrs["checked"]} משתמשים נבדקו, {len(recon)} לא תואמים</div>', unsafe_allow_html=True)
+        if recon.empty: render_empty_state("✅", "כל היתרות תואמות לפעולות")
+        else: st.dataframe(recon, hide_index=True, use_container_width=True,
+                           column_config={c: st.column_config.NumberColumn(c, format="₪%.2f")
+                                          for c in ("יתרה שמורה", "יתרה לפי פעולות", "הפרש")})
+    with at4:
+        rss = process_rss_mb()
+        report = get_memory_report(ver, {"משתמשים": df_users, "פעולות": df_actions,
+                                         "פעולות – מבט מנהל": get_admin_ledger(ver, df_actions)})
+        st.markdown(f'<div style="color:#64748b;font-size:0.8rem;margin-bottom:8px">הטבלאות המשותפות לכל הסשנים בתהליך הזה'
+                    f'{f" · זיכרון התהליך כרגע: {rss:,.0f} MB" if rss is not None else ""}</div>', unsafe_allow_html=True)
+        st.dataframe(report, hide_index=True, use_container_width=True,
+                     column_config={c: st.column_config.NumberColumn(c, format="%.1f") for c in ("MB", "MB ללא category")})
 
 
 # ============================
@@ -1624,8 +2676,10 @@ def main():
 
     # FIX #13 – spinner טעינה ראשונית
     with st.spinner("⏳ טוען נתונים..."):
-        df_users, df_actions, _ = get_all_data()
-    st.session_state._last_sync = datetime.now().strftime("%H:%M:%S")
+        data = get_data_snapshot()
+    df_users, df_actions, ver, kpi = data["users"], data["actions"], data["version"], data["kpi"]
+    synced = data["synced"]
+    st.session_state._last_sync = datetime.fromtimestamp(min(synced["users"], synced["actions"])).strftime("%H:%M:%S")
 
     # FIX #6 – כפתור צף אמיתי
     inject_chat_fab_js()
@@ -1634,12 +2688,12 @@ def main():
     if is_admin: tabs_labels.append("🛠️ ניהול מנהל")
     tab_objs = st.tabs(tabs_labels)
 
-    with tab_objs[0]: render_dashboard(u, is_admin, df_users, df_actions)
-    with tab_objs[1]: render_history(u, is_admin, df_users, df_actions)
-    with tab_objs[2]: render_personal(u, df_users)
-    with tab_objs[3]: render_chat_tab(u, is_admin, df_users, df_actions)
+    with tab_objs[0]: render_dashboard(u, is_admin, df_users, df_actions, ver, kpi)
+    with tab_objs[1]: render_history(u, is_admin, df_users, df_actions, ver)
+    with tab_objs[2]: render_personal(u, df_users, ver)
+    with tab_objs[3]: render_chat_tab(u, is_admin, df_users, df_actions, ver)
     if is_admin:
-        with tab_objs[4]: render_admin(df_users, df_actions)
+        with tab_objs[4]: render_admin(df_users, df_actions, ver, kpi)
 
     # Footer
     st.markdown(f"""
@@ -0,0 +1,60 @@
+"""סנכרון מצטבר של "פעולות": הוספת שורות חדשות שווה לטעינה מלאה של אותו גיליון."""
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main  # noqa: E402
+
+H    = ["תאריך", "שעה", "מספר משתמש מקור", "שם מקור", "מספר משתמש יעד", "שם יעד", "סכום", "סטטוס"]
+ROWS = [["01/10/2026", "10:00:00", "", "", "101", "דני", "100", "פעולת מנהל"],
+        ["02/10/2026", "11:30:00", "101", "דני", "102", "רות", "40", "מוצלחת"],
+        ["03/10/2026", "09:15:00", "102", "רות", "101", "דני", "abc", "כושלת"]]
+# כל הסכומים מספריים – "סכום" נשאר עמודה מספרית ולא category
+NUMERIC_ROWS = [r[:6] + ["25"] + r[7:] for r in ROWS]
+
+
+def new_state() -> dict:
+    return {"header": None, "rows": 0, "anchor": None, "df": None, "kpi": None, "full_at": 0.0}
+
+
+def incremental(first: list, then: list):
+    """טעינה מלאה של first[0] ואז סבב מצטבר שבו הגיליון הוא then."""
+    state = new_state()
+    main._apply_actions(state, [first])
+    tail  = then[state["rows"]:]  # העוגן (שורה rows+1) והלאה
+    return state, main._apply_actions(state, [[then[0]], tail])
+
+
+def full(values: list):
+    state = new_state()
+    return state, main._apply_actions(state, [values])
+
+
+def assert_same(a, b):
+    (state_a, df_a), (state_b, df_b) = a, b
+    pd.testing.assert_frame_equal(df_a, df_b)
+    assert main.kpi_summary(state_a["kpi"]) == main.kpi_summary(state_b["kpi"])
+    assert (state_a["rows"], state_a["anchor"]) == (state_b["rows"], state_b["anchor"])
+
+
+@pytest.mark.parametrize("rows", [ROWS, NUMERIC_ROWS])
+def test_append_to_empty_ledger(rows):
+    assert_same(incremental([H], [H] + rows), full([H] + rows))
+
+
+def test_append_to_existing_rows():
+    assert_same(incremental([H] + ROWS[:1], [H] + ROWS), full([H] + ROWS))
+
+
+def test_no_new_rows():
+    assert_same(incremental([H] + ROWS, [H] + ROWS), full([H] + ROWS))
+
+
+def test_changed_anchor_requests_full_reload():
+    state = new_state()
+    main._apply_actions(state, [[H] + ROWS[:2]])
+    edited = ROWS[1][:6] + ["41", ROWS[1][7]]
+    assert main._apply_actions(state, [[H], [edited, ROWS[2]]]) is None
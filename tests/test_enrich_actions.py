@@ -0,0 +1,89 @@
+"""התאמה בין _enrich_actions הווקטורי לבין המימוש הישן (apply שורה-שורה) של process_user_actions."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main  # noqa: E402
+
+
+def legacy_process_user_actions(df_actions: pd.DataFrame, user_id: str) -> pd.DataFrame:
+    """העתק קפוא של process_user_actions לפני הווקטוריזציה."""
+    if df_actions.empty: return pd.DataFrame()
+    df = df_actions.copy()
+    df["מספר משתמש מקור"] = df["מספר משתמש מקור"].astype(str)
+    df["מספר משתמש יעד"]  = df["מספר משתמש יעד"].astype(str)
+    uid  = str(user_id)
+    mask = (df["מספר משתמש מקור"] == uid) | (df["מספר משתמש יעד"] == uid)
+    my   = df[mask].copy()
+    if my.empty: return pd.DataFrame()
+
+    def _s(v):
+        s = str(v).strip()
+        return s if s not in ('', 'nan', 'None', '0') else ''
+
+    def enrich(row):
+        is_sender = str(row["מספר משתמש מקור"]) == uid
+        try:    amount = float(row.get("סכום",0))
+        except: amount = 0
+        direction = "חובה" if is_sender else "זכות"
+        net  = -amount if is_sender else amount
+        if is_sender:
+            name, uid_t = _s(row.get('שם יעד','')), _s(row.get('מספר משתמש יעד',''))
+            if name and uid_t:   desc = f"העברה אל {name} ({uid_t})"
+            elif name:           desc = f"העברה אל {name}"
+            elif uid_t:          desc = f"העברה אל משתמש {uid_t}"
+            else:                desc = "העברה יוצאת"
+        else:
+            name, uid_s = _s(row.get('שם מקור','')), _s(row.get('מספר משתמש מקור',''))
+            if name and uid_s:   desc = f"התקבל מ-{name} ({uid_s})"
+            elif name:           desc = f"התקבל מ-{name}"
+            elif uid_s:          desc = f"התקבל ממשתמש {uid_s}"
+            else:                desc = "קבלת העברה"
+        return pd.Series({"כיוון": direction, "סכום נטו": net, "תיאור": desc})
+
+    enriched = my.apply(enrich, axis=1)
+    return pd.concat([my.reset_index(drop=True), enriched.reset_index(drop=True)], axis=1)
+
+
+IDS     = ["101", "102", "103", "", "0", None, "nan"]
+NAMES   = ["דני", "רות כהן", " אבי ", "", None, "0", "nan"]
+AMOUNTS = ["", None, "0", "nan", "abc", "1_000", "12.5", " 7 ", 25.5, 100, 0, -40]
+ENRICHED = ["כיוון", "סכום נטו", "תיאור"]
+
+
+def random_ledger(n: int, seed: int) -> pd.DataFrame:
+    rnd  = np.random.default_rng(seed)
+    pick = lambda values: [values[i] for i in rnd.integers(len(values), size=n)]
+    return pd.DataFrame({
+        "תאריך": "2026-10-01", "שעה": "10:00:00",
+        "מספר משתמש מקור": pick(IDS), "שם מקור": pick(NAMES),
+        "מספר משתמש יעד": pick(IDS), "שם יעד": pick(NAMES),
+        "סכום": pick(AMOUNTS), "סטטוס": pick(["מוצלחת", "כושלת", "פעולת מנהל"]),
+    }, dtype=object)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("uid", ["101", "102", "0"])
+def test_enrich_matches_legacy(seed, uid):
+    raw = random_ledger(600, seed)
+    expected = legacy_process_user_actions(raw, uid)
+    actual   = main.process_user_actions(main._normalize_actions(raw), uid)
+    assert not expected.empty
+    pd.testing.assert_frame_equal(actual[ENRICHED].reset_index(drop=True),
+                                  expected[ENRICHED].astype({"סכום נטו": float}), check_dtype=False)
+
+
+def test_enrich_with_index_matches_mask():
+    df    = main._normalize_actions(random_ledger(300, 99))
+    index = main.get_user_action_index("test", df)
+    for uid in ("101", "103"):
+        pd.testing.assert_frame_equal(main.process_user_actions(df, uid, index),
+                                      main.process_user_actions(df, uid))
+
+
+def test_no_matching_rows():
+    assert main.process_user_actions(main._normalize_actions(random_ledger(50, 1)), "999").empty